@@ -1,4 +1,13 @@
 from .modeler import NLPTopicModeler
+from .stream import StreamingModeler
 from .classify import Classifier
 from .condense import Condenser
-from .summarize import Summarizer
\ No newline at end of file
+from .summarize import Summarizer
+from .cache import ResponseCache, EmbeddingCache
+from .ratelimit import RateLimiter
+from .checkpoint import Checkpoint
+from .metrics import Metrics
+from .embed import Embedder, azure_embed_fn
+from .aio import AsyncSummarizer, AsyncClassifier, AsyncCondenser
+from .pool import ClientPool, AsyncClientPool, Endpoint
+from .batch import BatchRunner, AzureBatchTransport
\ No newline at end of file
@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime
+from tqdm import tqdm
+from .summarize import Summarizer
+from .classify import Classifier
+from .condense import Condenser
+from .dispatch import abounded_map
+
+# Async variants of the pipeline stages. They keep the prompts and result
+# handling of the threaded classes but await an AsyncAzureOpenAI client, with
+# `workers` acting as the number of rows (or batches) allowed in flight at once.
+
+class AsyncSummarizer(Summarizer):
+    async def asummarize_transcript(self, transcript: str):
+        return await self.achat(self.build_messages(transcript), 'summarize')
+
+    async def abulk_summarize_transcripts(self):
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin Summarizing {len(self.dataframe)} Transcripts")
+
+        async def process_row(position, transcript):
+            try:
+                result = await self.asummarize_transcript(transcript)
+                return position, result
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED with exception {e}")
+                return position, None
+
+        items = self.pending_items()
+        with tqdm(total=len(items), desc="Summarizing") as progress:
+            async for result in abounded_map(process_row, items, self.workers):
+                self.record(*result)
+                progress.update(1)
+
+        self.finish(start_time)
+
+
+class AsyncClassifier(Classifier):
+    async def aclassify_batch(self, transcripts, batch_prompt, system_prompt):
+
+        cascade = bool(self.cascade_model)
+        try:
+            content = await self.acomplete(self.build_batch_messages(transcripts, batch_prompt), cascade=cascade)
+        except Exception as e:
+            answers = self.failed_batch(transcripts, e)
+        else:
+            answers = self.parse_batch(content, len(transcripts))
+            answers = [self.accept(answer) if cascade else self.normalize(answer) for answer in answers]
+
+        missing = [number for number, answer in enumerate(answers) if answer is None]
+        if missing:
+            self.log(f"{datetime.now()}: Re-querying {len(missing)} of {len(transcripts)} batch items individually")
+        retried = await asyncio.gather(*[self.aask(transcripts[number], system_prompt) for number in missing], return_exceptions=True)
+        for number, answer in zip(missing, retried):
+            if isinstance(answer, Exception):
+                self.log(f"{datetime.now()}: FAILED with exception {answer}")
+                answer = None
+            answers[number] = answer
+
+        return answers
+
+    async def aask(self, transcript, system_prompt, cascade: bool = False):
+        if self.constrained:
+            return self.parse_topic_id(await self.acomplete(self.build_constrained_messages(transcript, system_prompt), max_tokens=1, logit_bias=self.logit_bias, cascade=cascade))
+        return await self.acomplete(self.build_messages(transcript, system_prompt), cascade=cascade)
+
+    async def aclassify_transcript(self, transcript, system_prompt):
+        if self.cascade_model:
+            try:
+                answer = await self.aask(transcript, system_prompt, cascade=True)
+            except Exception as e:
+                answer = self.failed_cascade(e)
+            else:
+                answer = self.accept(answer)
+            if answer is not None:
+                return answer
+        return await self.aask(transcript, system_prompt)
+
+    async def acomplete(self, message_pkg, max_tokens: int = None, logit_bias: dict = None, cascade: bool = False):
+        options = {'logit_bias': logit_bias} if logit_bias else None
+        if cascade:
+            return await self.achat(message_pkg, 'classify_cascade', max_tokens, self.cascade_model, self.cascade_client, options)
+        return await self.achat(message_pkg, 'classify', max_tokens, options=options)
+
+    async def aclassify_topics(self):
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin Classifying {len(self.dataframe)} Transcripts")
+
+        system_prompt = self.build_system_prompt()
+
+        async def process_row(position, transcript):
+            try:
+                result = await self.aclassify_transcript(transcript, system_prompt)
+                return position, result
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED with exception {e}")
+                return position, None
+
+        if self.batch_size > 1:
+            await self.aclassify_batches(system_prompt)
+        else:
+            # embedding assignment makes blocking HTTP calls, so it runs off the event loop
+            items = await asyncio.to_thread(self.pending_items)
+            with tqdm(total=len(items), desc="Classifying") as progress:
+                async for result in abounded_map(process_row, items, self.workers):
+                    self.record(*result)
+                    progress.update(1)
+
+        self.finish(start_time)
+
+    async def aclassify_batches(self, system_prompt):
+
+        batch_prompt = self.build_batch_system_prompt()
+        items = await asyncio.to_thread(self.pending_items)
+        batches = self.build_batches(items, batch_prompt)
+        self.log(f"{datetime.now()}: Packed {len(items)} Transcripts into {len(batches)} Batches")
+
+        async def process_batch(batch):
+            try:
+                answers = await self.aclassify_batch([transcript for _, transcript in batch], batch_prompt, system_prompt)
+                return [(position, answer) for (position, _), answer in zip(batch, answers)]
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED with exception {e}")
+                return [(position, None) for position, _ in batch]
+
+        with tqdm(total=len(items), desc="Classifying") as progress:
+            async for results in abounded_map(process_batch, ((batch,) for batch in batches), self.workers):
+                for position, topic in results:
+                    self.record(position, topic)
+                progress.update(len(results))
+
+
+class AsyncCondenser(Condenser):
+    async def acondense_topics_openai_call(self, topics_list, system_prompt=None):
+        try:
+            return await self.achat(self.build_messages(topics_list, system_prompt), 'condense')
+        except Exception as e:
+            self.log(f"An error occurred: {e}")
+            return None
+
+    async def acondense_topics_from_dataframe(self):
+
+        system_prompt = self.build_system_prompt()
+        start_time = datetime.now()
+        self.log(f'{start_time}: Begin condensing topics')
+
+        # the three sampled batches are independent, so condense them together
+        condensed = await asyncio.gather(*[self.acondense_topics_openai_call(batch, system_prompt)
+                                           for batch in self.sample_batches()])
+
+        final_batch = [line for result in condensed for line in result.split("\n")]
+
+        final_condensed = (await self.acondense_topics_openai_call(final_batch)).split('\n')
+
+        self.finish(final_condensed, start_time)
+
+    async def amap_reduce_topics_from_dataframe(self):
+
+        system_prompt = self.build_system_prompt()
+        start_time = datetime.now()
+        shards = self.shard_batches()
+        self.log(f'{start_time}: Begin map-reduce condensing of {len(shards)} shards')
+
+        semaphore = asyncio.Semaphore(self.workers)
+        async def call(topics_list, system_prompt=None):
+            async with semaphore:
+                return await self.acondense_topics_openai_call(topics_list, system_prompt)
+
+        partials = self.split_results(await asyncio.gather(*[call(shard, system_prompt) for shard in shards]))
+        while True:
+            partials = self.split_results(await asyncio.gather(*[call(group) for group in self.merge_groups(partials)]))
+            self.log(f'{datetime.now()}: Reduced to {len(partials)} topic lists')
+            if len(partials) <= 1: break
+
+        self.finish(partials[0] if partials else [], start_time)
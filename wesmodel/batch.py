@@ -0,0 +1,175 @@
+import json
+import os
+import time
+from datetime import datetime
+from .cache import ResponseCache
+from .logwriter import get_log_writer
+
+# Sends a stage's requests through the Batch API instead of one chat completion at
+# a time. Requests are written as JSONL files within the size limits, handed to a
+# transport, polled until they finish, and the output files are read back line by
+# line. Anything the batch did not answer is left for the caller to retry.
+
+TERMINAL = ('completed', 'failed', 'expired', 'cancelled')
+
+class AzureBatchTransport:
+    def __init__(self,
+            client,
+            endpoint: str = '/chat/completions',
+            completion_window: str = '24h'
+            ):
+        self.client = client
+        self.endpoint = endpoint
+        self.completion_window = completion_window
+
+    def upload(self, path: str):
+        with open(path, 'rb') as file:
+            return self.client.files.create(file=file, purpose='batch').id
+
+    def submit(self, file_id: str):
+        return self.client.batches.create(input_file_id=file_id,
+                                          endpoint=self.endpoint,
+                                          completion_window=self.completion_window).id
+
+    def status(self, batch_id: str):
+        batch = self.client.batches.retrieve(batch_id)
+        return {'status': batch.status,
+                'output_file_id': batch.output_file_id,
+                'error_file_id': batch.error_file_id}
+
+    def download(self, file_id: str, path: str):
+        self.client.files.content(file_id).write_to_file(path)
+
+    def cancel(self, batch_id: str):
+        self.client.batches.cancel(batch_id)
+
+class BatchRunner:
+    def __init__(self,
+            transport,
+            directory: str = './batches',
+            max_requests: int = 50000,
+            max_bytes: int = 100*1024*1024,
+            poll_interval: float = 60,
+            timeout: float = None,
+            log_path: str = f'./logs'
+            ):
+        if max_requests < 1 or max_bytes < 1:
+            raise ValueError('max_requests and max_bytes must be positive.')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.transport = transport
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.logger = get_log_writer(log_path)
+        self.submitted = 0
+        self.answered = 0
+        self.errors = 0
+
+    def log(self, input: str):
+        self.logger.log(type(self).__name__, input)
+
+    def cache_key(self, cache: ResponseCache, body: dict):
+        messages = body['messages']
+        return cache.make_key(body['model'], messages[0]['content'], messages[1]['content'], body['temperature'], body['max_tokens'])
+
+    def write_requests(self, name: str, requests, cache: ResponseCache = None):
+        # one JSONL file per max_requests lines or max_bytes, whichever comes first;
+        # returns the files, the answers already in the cache and the cache key of every written request
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        paths, cached, keys = [], [], {}
+        file, count, size = None, 0, 0
+        try:
+            for custom_id, body in requests:
+                if cache:
+                    key = self.cache_key(cache, body)
+                    content = cache.get(key)
+                    if content is not None:
+                        cached.append((custom_id, content))
+                        continue
+                    keys[str(custom_id)] = key
+                line = (json.dumps({'custom_id': str(custom_id), 'method': 'POST', 'url': self.transport.endpoint, 'body': body}) + '\n').encode('utf-8')
+                if len(line) > self.max_bytes:
+                    raise ValueError(f"Request {custom_id} is {len(line)} bytes, over the {self.max_bytes} byte file limit")
+                if file is None or count >= self.max_requests or size + len(line) > self.max_bytes:
+                    if file is not None:
+                        file.close()
+                    paths.append(os.path.join(self.directory, f'{name}-{stamp}-{len(paths):04d}.jsonl'))
+                    file = open(paths[-1], 'wb')
+                    count, size = 0, 0
+                file.write(line)
+                count += 1
+                size += len(line)
+        finally:
+            if file is not None:
+                file.close()
+        return paths, cached, keys
+
+    def wait(self, batches):
+        # polls every batch until it reaches a terminal state or the timeout passes
+        start = time.monotonic()
+        states = {}
+        while True:
+            for batch_id in batches:
+                if batch_id not in states or states[batch_id]['status'] not in TERMINAL:
+                    states[batch_id] = self.transport.status(batch_id)
+            pending = [batch_id for batch_id in batches if states[batch_id]['status'] not in TERMINAL]
+            if not pending:
+                return states
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                self.log(f"{datetime.now()}: Cancelling {len(pending)} batches still running after {self.timeout} seconds")
+                for batch_id in pending:
+                    self.transport.cancel(batch_id)
+                return states
+            time.sleep(self.poll_interval)
+
+    def parse_line(self, line: str):
+        entry = json.loads(line)
+        response = entry.get('response') or {}
+        if entry.get('error') or response.get('status_code') != 200:
+            return entry['custom_id'], None
+        try:
+            return entry['custom_id'], response['body']['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            return entry['custom_id'], None
+
+    def read_results(self, path: str, keys: dict, cache: ResponseCache = None):
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                custom_id, content = self.parse_line(line)
+                if content is None:
+                    self.errors += 1
+                else:
+                    self.answered += 1
+                    if cache and custom_id in keys:
+                        cache.set(keys[custom_id], content)
+                yield custom_id, content
+
+    def run(self, name: str, requests, cache: ResponseCache = None):
+        # yields (custom_id, content) for every answer, content is None for items the batch failed;
+        # items that are never yielded were lost with a failed or cancelled batch
+        paths, cached, keys = self.write_requests(name, requests, cache)
+        if cached:
+            self.log(f"{datetime.now()}: Answered {len(cached)} {name} requests from the cache")
+        yield from cached
+
+        batches = {}
+        for path in paths:
+            batch_id = self.transport.submit(self.transport.upload(path))
+            batches[batch_id] = path
+            self.log(f"{datetime.now()}: Submitted batch {batch_id} from {path}")
+        self.submitted += len(batches)
+
+        states = self.wait(list(batches))
+        for batch_id, state in states.items():
+            self.log(f"{datetime.now()}: Batch {batch_id} {state['status']}")
+            for kind in ('output_file_id', 'error_file_id'):
+                if not state.get(kind):
+                    continue
+                path = batches[batch_id][:-len('.jsonl')] + ('.output.jsonl' if kind == 'output_file_id' else '.errors.jsonl')
+                self.transport.download(state[kind], path)
+                yield from self.read_results(path, keys, cache)
@@ -0,0 +1,177 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from .fake import FakeAzureOpenAI, FakeAsyncAzureOpenAI, DEFAULT_TOPICS
+from .modeler import NLPTopicModeler
+from .ratelimit import RateLimiter
+
+# Runs pipeline stages against the simulated backend in fake.py and reports
+# throughput, so changes to the dispatch path can be measured without quota.
+#
+#   python -m wesmodel.benchmark --stages classify summarize --rows 10000 --workers 1 4 16 64
+
+STAGES = ('summarize', 'classify', 'condense', 'model_column', 'amodel_column')
+
+FILLER = np.array(['order', 'account', 'called', 'said', 'please', 'help', 'week', 'again', 'card',
+                   'email', 'phone', 'number', 'agent', 'waiting', 'today', 'issue', 'thanks', 'since',
+                   'charged', 'package', 'store', 'online', 'support', 'problem', 'update', 'status'])
+
+def synthetic_dataframe(rows: int,
+        column: str = 'text',
+        topics=DEFAULT_TOPICS,
+        words: int = 40,
+        duplicate_rate: float = 0.0,
+        seed: int = 0):
+    rng = np.random.default_rng(seed)
+    topic_ids = rng.integers(len(topics), size=rows)
+    filler = rng.choice(FILLER, size=(rows, words))
+    texts = [f"Customer contacted us about {topics[topic].lower()}. " + ' '.join(row) for topic, row in zip(topic_ids, filler)]
+    if duplicate_rate and rows > 1:
+        copies = np.flatnonzero(rng.random(rows) < duplicate_rate)
+        copies = copies[copies > 0]
+        sources = rng.integers(0, copies)
+        for copy, source in zip(copies, sources):
+            texts[copy] = texts[source]
+    return pd.DataFrame({column: texts})
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/(1024*1024) if sys.platform == 'darwin' else peak/1024
+
+def run_case(config: dict):
+    stage, rows, workers = config['stage'], config['rows'], config['workers']
+    topics = DEFAULT_TOPICS[:config.get('num_topics', len(DEFAULT_TOPICS))]
+    dataframe = synthetic_dataframe(rows, topics=topics, duplicate_rate=config.get('duplicate_rate', 0.0), seed=config.get('seed', 0))
+    backend = dict(latency=config.get('latency', 0.05),
+                   latency_sigma=config.get('latency_sigma', 0.0),
+                   rate_limit_rate=config.get('rate_limit_rate', 0.0),
+                   max_concurrency=config.get('max_concurrency'),
+                   retry_after=config.get('retry_after'),
+                   seed=config.get('seed', 0))
+    client = FakeAzureOpenAI(**backend)
+    async_client = FakeAsyncAzureOpenAI(**backend)
+
+    with tempfile.TemporaryDirectory() as log_path:
+        modeler = NLPTopicModeler(dataframe=dataframe,
+                                  azure_client=client,
+                                  azure_model='benchmark',
+                                  log_path=log_path,
+                                  azure_async_client=async_client,
+                                  rate_limiter=RateLimiter(base_backoff=config.get('base_backoff', 1)))
+        start = time.perf_counter()
+        if stage == 'summarize':
+            modeler.summarize(target_column='text', workers=workers, dedup=config.get('dedup', False))
+        elif stage == 'classify':
+            modeler.classify(topics=topics, target_column='text', workers=workers,
+                             batch_size=config.get('batch_size', 1), dedup=config.get('dedup', False),
+                             constrained=config.get('constrained', False))
+        elif stage == 'condense':
+            modeler.condense(target_column='text', num_topics=len(topics),
+                             map_reduce=config.get('map_reduce', False), workers=workers)
+        elif stage == 'model_column':
+            modeler.model_column(target_column='text', num_topics=len(topics), workers=workers,
+                                 dedup=config.get('dedup', False), map_reduce=config.get('map_reduce', False),
+                                 constrained=config.get('constrained', False))
+        elif stage == 'amodel_column':
+            asyncio.run(modeler.amodel_column(target_column='text', num_topics=len(topics), workers=workers,
+                                              dedup=config.get('dedup', False), map_reduce=config.get('map_reduce', False),
+                                              constrained=config.get('constrained', False)))
+        else:
+            raise ValueError(f"Unknown stage {stage}, expected one of {', '.join(STAGES)}")
+        wall = time.perf_counter() - start
+
+    calls = client.stats() if stage != 'amodel_column' else async_client.stats()
+    latency = {}
+    for name, stats in modeler.metrics.summary().items():
+        if stats['latency']:
+            latency[name] = {'p50': stats['latency']['p50'], 'p99': stats['latency']['p99']}
+    return {**config,
+            'wall_seconds': wall,
+            'rows_per_second': rows/wall if wall else None,
+            'peak_rss_mb': peak_rss_mb(),
+            **calls,
+            'latency': latency}
+
+def run_isolated(config: dict):
+    # a fresh process per case keeps peak RSS from carrying over between runs
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_case, (config,))
+
+def run_suite(stages, rows, workers, isolate: bool = True, **options):
+    results = []
+    for stage in stages:
+        for row_count in rows:
+            baseline = None
+            for worker_count in workers:
+                config = {'stage': stage, 'rows': row_count, 'workers': worker_count, **options}
+                result = run_isolated(config) if isolate else run_case(config)
+                baseline = baseline or result['rows_per_second']
+                result['speedup'] = result['rows_per_second']/baseline if baseline else None
+                results.append(result)
+                print(format_row(result), flush=True)
+    return results
+
+HEADER = f"{'stage':<14}{'rows':>9}{'workers':>9}{'wall s':>10}{'rows/s':>11}{'speedup':>9}{'rss MB':>9}{'calls':>9}{'429s':>7}{'peak':>7}"
+
+def format_row(result: dict):
+    rss = f"{result['peak_rss_mb']:.0f}" if result['peak_rss_mb'] is not None else '-'
+    return (f"{result['stage']:<14}{result['rows']:>9}{result['workers']:>9}{result['wall_seconds']:>10.2f}"
+            f"{result['rows_per_second']:>11.1f}{result['speedup']:>9.2f}{rss:>9}{result['calls']:>9}"
+            f"{result['throttled']:>7}{result['peak_in_flight']:>7}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m wesmodel.benchmark',
+                                     description='Measure wesmodel throughput against a simulated Azure OpenAI backend.')
+    parser.add_argument('--stages', nargs='+', default=['classify'], choices=STAGES)
+    parser.add_argument('--rows', nargs='+', type=int, default=[1000])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 16, 64])
+    parser.add_argument('--latency', type=float, default=0.05, help='median seconds per request')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='lognormal spread of request latency')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with a 429')
+    parser.add_argument('--max-concurrency', type=int, default=None, help='answer requests beyond this many in flight with a 429')
+    parser.add_argument('--retry-after', type=float, default=None, help='retry-after header sent with simulated 429s')
+    parser.add_argument('--base-backoff', type=float, default=1)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--num-topics', type=int, default=len(DEFAULT_TOPICS))
+    parser.add_argument('--duplicate-rate', type=float, default=0.0)
+    parser.add_argument('--dedup', action='store_true')
+    parser.add_argument('--map-reduce', action='store_true')
+    parser.add_argument('--constrained', action='store_true', help='classify with topic IDs and logit_bias')
+    parser.add_argument('--no-isolate', action='store_true', help='run every case in this process')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('TQDM_DISABLE', '1')
+    print(HEADER)
+    results = run_suite(args.stages, args.rows, args.workers,
+                        isolate=not args.no_isolate,
+                        latency=args.latency,
+                        latency_sigma=args.latency_sigma,
+                        rate_limit_rate=args.rate_limit_rate,
+                        max_concurrency=args.max_concurrency,
+                        retry_after=args.retry_after,
+                        base_backoff=args.base_backoff,
+                        batch_size=args.batch_size,
+                        num_topics=args.num_topics,
+                        duplicate_rate=args.duplicate_rate,
+                        dedup=args.dedup,
+                        map_reduce=args.map_reduce,
+                        constrained=args.constrained)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return results
+
+if __name__ == '__main__':
+    main()
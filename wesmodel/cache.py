@@ -0,0 +1,179 @@
+import sqlite3
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+
+class ResponseCache:
+    def __init__(self,
+            path: str = './cache/responses.sqlite',
+            max_entries: int = None,
+            max_age: timedelta = None,
+            evict_every: int = 1000
+            ):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        # access times of cache hits, written back in bulk instead of one commit per hit
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+        self.evict()
+
+    def make_key(self, model: str, system_prompt: str, user_prompt: str, temperature: float, max_tokens: int):
+        payload = json.dumps([model, system_prompt, user_prompt, temperature, max_tokens])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.max_age and now - row[1] > self.max_age.total_seconds()):
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            self.hits += 1
+            due = len(self._touched) >= self.evict_every
+        if due:
+            self.flush()
+        return row[0]
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany("UPDATE responses SET accessed = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._touched.items()])
+            self._touched = {}
+
+    def flush(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def set(self, key: str, response: str):
+        if response is None:
+            return
+        with self._lock:
+            now = time.time()
+            self._conn.execute("INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                               (key, response, now, now))
+            self._conn.commit()
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._flush_touched()
+            if self.max_age:
+                cutoff = time.time() - self.max_age.total_seconds()
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+            if self.max_entries:
+                self._conn.execute("""DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._touched = {}
+            self.hits = 0
+            self.misses = 0
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/lookups if lookups else 0.0,
+                'entries': self.size()}
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+            self._conn.close()
+
+class EmbeddingCache:
+    def __init__(self, path: str = './cache/embeddings.sqlite'):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            created REAL NOT NULL)""")
+        self._conn.commit()
+
+    def make_key(self, model: str, text: str):
+        payload = json.dumps([model, text])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        # returns {key: float32 vector} for the keys that are cached
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start+500]
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?'*len(chunk))})", chunk).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, created) VALUES (?, ?, ?)",
+                                   [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits/lookups if lookups else 0.0,
+                'entries': self.size()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+
+def text_hash(text):
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:16]
+
+def json_label(label):
+    # index labels come back from JSON as plain Python values, and tuples as lists
+    if hasattr(label, 'item'):
+        return label.item()
+    if isinstance(label, tuple):
+        return [json_label(part) for part in label]
+    return label
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # a crash can leave the last line half written
+                    continue
+        return entries
+
+    def load(self):
+        return {entry['index']: entry['result'] for entry in self.entries()}
+
+    def resume(self, index, texts):
+        # maps journaled results to row positions of the current frame by index label, so a frame
+        # that was reordered or filtered still gets each result on its own row; an entry whose text
+        # no longer matches the row's text is dropped and the row is answered again
+        found = {}
+        entries = self.entries()
+        if index.is_unique:
+            latest = {}
+            for entry in entries:
+                label = entry['index']
+                latest[tuple(label) if isinstance(label, list) else label] = entry
+            positions = index.get_indexer(list(latest)) if latest else []
+            for entry, position in zip(latest.values(), positions):
+                if position >= 0 and entry.get('hash', text_hash(texts[position])) == text_hash(texts[position]):
+                    found[position] = entry['result']
+        else:
+            # a repeated label does not pick out one row, so the text hash has to match as well
+            rows = {}
+            for position, label in enumerate(index):
+                rows.setdefault((json.dumps(json_label(label)), text_hash(texts[position])), []).append(position)
+            for entry in entries:
+                for position in rows.get((json.dumps(entry['index']), entry.get('hash')), []):
+                    found[position] = entry['result']
+        return found
+
+    def append(self, index, result, text=None):
+        entry = {'index': json_label(index), 'result': result}
+        if text is not None:
+            entry['hash'] = text_hash(text)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class Checkpoint:
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+
+    def journal(self, column: str):
+        return Journal(f'{self.path}/{column}.jsonl')
+
+    def load_topics(self, name: str):
+        path = f'{self.path}/{name}.topics.json'
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as topics:
+            return json.load(topics)
+
+    def save_topics(self, name: str, topics):
+        # write then rename so an interrupted save never leaves a truncated topic list behind
+        path = f'{self.path}/{name}.topics.json'
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(topics, file)
+        os.replace(path + '.tmp', path)
@@ -4,10 +4,27 @@ import pandas as pd
 from datetime import datetime
 from typing import List
 import time
+import re
+import threading
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .metrics import Metrics
+from .results import OK, FAILED, SKIPPED
+from .checkpoint import Journal
+from .dispatch import bounded_map
+from .stage import RowStage
+from .batch import BatchRunner
+from .embed import Embedder, nearest_topics
+from .pool import ClientPool
+from . import tokens
+from .logwriter import get_log_writer
 
-class Classifier:
+# chat completions accept at most this many logit_bias entries
+MAX_LOGIT_BIAS = 300
+
+class Classifier(RowStage):
     def __init__(self,
             dataframe: pd.DataFrame,
             azure_client: AzureOpenAI,
@@ -19,12 +36,38 @@ class Classifier:
             workers: int = 5,
             log_path: str = f'./logs',
             temperature: float = 0,
-            max_reply_tokens: int = 1000
+            max_reply_tokens: int = 1000,
+            cache: ResponseCache = None,
+            rate_limiter: RateLimiter = None,
+            batch_size: int = 1,
+            batch_token_budget: int = 4000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            journal: Journal = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            token_counts: pd.Series = None,
+            embedder: Embedder = None,
+            embedding_margin: float = 0.05,
+            metrics: Metrics = None,
+            constrained: bool = False,
+            encoding_name: str = 'cl100k_base',
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None
             ):
         if target_column not in dataframe.columns:
             raise ValueError(f"Dataframe does not contain column {target_column}")
+        if over_budget not in ['truncate', 'skip']:
+            raise ValueError('over_budget must be "truncate" or "skip".')
         if category.lower() not in ['topic', 'subtopic']:
             raise ValueError('Category must be "topic" or "subtopic".')
+        if constrained and batch_size > 1:
+            raise ValueError('Constrained classification answers one text per request, batch_size must be 1.')
+        if constrained and len(topics) >= MAX_LOGIT_BIAS:
+            raise ValueError(f'Constrained classification supports at most {MAX_LOGIT_BIAS - 1} {category}s.')
+        if cascade_model and isinstance(cascade_client or azure_client, ClientPool):
+            # a pool sends every request to its own deployments, so cascade_model would never be called
+            raise ValueError('A cascade cannot run through a ClientPool, pass the cascade deployment\'s own client as cascade_client.')
         self.dataframe = dataframe
         self.azure_client = azure_client
         self.azure_model = azure_model
@@ -34,14 +77,57 @@ class Classifier:
         self.category = category
         self.workers = workers
         self.log_path = log_path
+        self.logger = get_log_writer(log_path)
         self.temperature = temperature
         self.max_reply_tokens = max_reply_tokens
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+        self.batch_size = batch_size
+        self.batch_token_budget = batch_token_budget
+        self.dedup = dedup
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.groups = None
+        self.calls_saved = 0
+        self.results = None
+        self.texts = None
+        self.journal = journal
+        self.max_text_tokens = max_text_tokens
+        self.over_budget = over_budget
+        self.token_counts = token_counts
+        self.embedder = embedder
+        self.embedding_margin = embedding_margin
+        self.embedding_assigned = 0
         self.duration = None
+        self.constrained = constrained
+        self.encoding_name = encoding_name
+        if constrained:
+            # ID 0 means none of the topics fit, the rest are numbered from 1 in list order
+            self.topic_ids = {'0': f"no {category}", **{str(number): topic for number, topic in enumerate(topics, 1)}}
+            self.logit_bias = {token: 100 for token in tokens.single_token_ids(self.topic_ids, encoding_name)}
+        # with a cascade, cascade_model answers first and azure_model only sees the rows it could not settle
+        self.cascade_model = cascade_model
+        self.cascade_client = cascade_client or azure_client
+        self.topic_lookup = {topic.lower(): topic for topic in topics}
+        self.cascade_counts = dict.fromkeys(['accepted', 'escalated', 'no_topic', 'unknown_label', 'unparsed', 'failed'], 0)
+        self._cascade_lock = threading.Lock()
     
     def log(self, input: str):
-        print(input, file=open(f'{self.log_path}/{datetime.now().date()}.txt', 'a'))
+        self.logger.log(type(self).__name__, input)
     
-    def classify_transcript(self, transcript, system_prompt):
+    def build_system_prompt(self):
+        if self.constrained:
+            return self.build_constrained_system_prompt()
+        return f"""You are a helpful bot that is given a list of {self.category}s and a single piece of text.
+            Assign one of the {self.category}s to the text. The {self.category}s are separated by the '|' character.
+            If you cannot find an appropriate {self.category}, simply respond 'no {self.category}'.
+            
+            Instructions:
+            - Assign one of the {self.category}s to the text
+            - Use only {self.category}s from the list you are given without changing names or extrapolating
+            - If none of the {self.category}s fit, respond '{self.category}'"""
+
+    def build_messages(self, transcript, system_prompt):
     
         user_prompt = f"""
             Topics:
@@ -53,77 +139,310 @@ class Classifier:
             Assigned Topic:
             """
         
-        message_pkg = [{"role":"system","content":system_prompt},
-                        {"role":"user","content":user_prompt}]
-        
-        attempt = 0
-        while True:
-            try:
-                response = self.azure_client.chat.completions.create(
-                    model=self.azure_model,
-                    messages=message_pkg,
-                    temperature=self.temperature,
-                    max_tokens=self.max_reply_tokens,
-                )
-
-                if response is None:
-                    self.log(f"{datetime.now()}: Failed no response")
-                    return None
-                return response.choices[0].message.content
-            except openai.RateLimitError as e:
-                attempt += 1
-                time.sleep(2 ** attempt)
-            except Exception as e:
-                self.log(f"{datetime.now()}: Failed with error {e}")
-                return f"FAILED: {e}"
-            
-    def classify_topics(self):
+        return [{"role":"system","content":system_prompt},
+                {"role":"user","content":user_prompt}]
 
-        df = self.dataframe
-        start_time = datetime.now()
-        self.log(f"{start_time}: Begin Classifying {len(df)} Transcripts")
+    def build_constrained_system_prompt(self):
+        # the whole topic list lives in this fixed prefix so the server-side prompt cache is hit on every row
+        ids = '\n            '.join(f"{number}. {topic}" for number, topic in self.topic_ids.items() if number != '0')
+        return f"""You are a helpful bot that is given a numbered list of {self.category}s and a single piece of text.
+            Assign one of the {self.category}s to the text and respond with its number only.
+            If none of the {self.category}s fit, respond 0.
 
+            {self.category.title()} IDs:
+            {ids}"""
 
-        df[self.topic_name] = None
+    def build_constrained_messages(self, transcript, system_prompt):
+        return [{"role":"system","content":system_prompt},
+                {"role":"user","content":str(transcript)}]
 
-        system_prompt = f"""You are a helpful bot that is given a list of {self.category}s and a single piece of text.
-            Assign one of the {self.category}s to the text. The {self.category}s are separated by the '|' character.
-            If you cannot find an appropriate {self.category}, simply respond 'no {self.category}'.
-            
-            Instructions:
-            - Assign one of the {self.category}s to the text
-            - Use only {self.category}s from the list you are given without changing names or extrapolating
-            - If none of the {self.category}s fit, respond '{self.category}'"""
+    def build_batch_system_prompt(self):
+        return self.build_system_prompt() + f"""
+            - You will receive several numbered pieces of text. Assign a {self.category} to every one of them
+            - Respond with one line per piece of text formatted like so: [number]. [{self.category}]"""
+
+    def build_batch_messages(self, transcripts, system_prompt):
+
+        texts = '\n\n'.join(f"{number}. {transcript}" for number, transcript in enumerate(transcripts, 1))
+
+        user_prompt = f"""
+            Topics:
+            {'|'.join(self.topics)}
+
+            Pieces of Text:
+            {texts}
+
+            Assigned Topics:
+            """
 
-        def process_row(index, row):
+        return [{"role":"system","content":system_prompt},
+                {"role":"user","content":user_prompt}]
+
+    def build_batches(self, items, system_prompt):
+        # pack (position, text) pairs into batches of at most batch_size items that fit the token budget
+        overhead = tokens.count_tokens(system_prompt, self.encoding_name) + tokens.count_tokens('|'.join(self.topics), self.encoding_name)
+        counts = self.item_token_counts(items)
+        if self.max_text_tokens:
+            counts = counts.clip(max=self.max_text_tokens)
+        batches, batch, batch_tokens = [], [], overhead
+        for (position, transcript), count in zip(items, counts):
+            if batch and (len(batch) >= self.batch_size or batch_tokens + count > self.batch_token_budget):
+                batches.append(batch)
+                batch, batch_tokens = [], overhead
+            batch.append((position, transcript))
+            batch_tokens += count
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def parse_batch(self, content, size):
+        answers = [None]*size
+        if not content:
+            return answers
+        for line in content.split('\n'):
+            match = re.match(r'^\s*\[?(\d+)\]?\s*[.):-]\s*(.*?)\s*$', line)
+            if match and 1 <= int(match.group(1)) <= size:
+                answers[int(match.group(1)) - 1] = match.group(2).strip('[]"\' ') or None
+        return answers
+
+    def classify_batch(self, transcripts, batch_prompt, system_prompt):
+
+        cascade = bool(self.cascade_model)
+        try:
+            content = self.complete(self.build_batch_messages(transcripts, batch_prompt), cascade=cascade)
+        except Exception as e:
+            answers = self.failed_batch(transcripts, e)
+        else:
+            answers = self.parse_batch(content, len(transcripts))
+            answers = [self.accept(answer) if cascade else self.normalize(answer) for answer in answers]
+
+        # anything the batch reply left out, garbled or could not settle is asked again on its own
+        missing = [number for number, answer in enumerate(answers) if answer is None]
+        if missing:
+            self.log(f"{datetime.now()}: Re-querying {len(missing)} of {len(transcripts)} batch items individually")
+        for number in missing:
             try:
-                result = self.classify_transcript(row[self.target_column], system_prompt)
-                return index, result
+                answers[number] = self.ask(transcripts[number], system_prompt)
             except Exception as e:
                 self.log(f"{datetime.now()}: FAILED with exception {e}")
-                return index, None
 
-        def update_df(result):
-            index, topic = result
-            if topic is None:
-                df.at[index, self.topic_name] = 'FAILED: Uncaught Exception'
+        return answers
+
+    def failed_batch(self, transcripts, error):
+        self.log(f"{datetime.now()}: FAILED batch of {len(transcripts)} with exception {error}")
+        if self.cascade_model:
+            self.count_cascade('failed', len(transcripts))
+        return [None]*len(transcripts)
+
+    def failed_cascade(self, error):
+        self.log(f"{datetime.now()}: FAILED {self.cascade_model} with exception {error}, escalating")
+        self.count_cascade('failed')
+        return None
+
+    def ask(self, transcript, system_prompt, cascade: bool = False):
+        if self.constrained:
+            return self.parse_topic_id(self.complete(self.build_constrained_messages(transcript, system_prompt), max_tokens=1, logit_bias=self.logit_bias, cascade=cascade))
+        return self.complete(self.build_messages(transcript, system_prompt), cascade=cascade)
+
+    def classify_transcript(self, transcript, system_prompt):
+        if self.cascade_model:
+            try:
+                answer = self.ask(transcript, system_prompt, cascade=True)
+            except Exception as e:
+                answer = self.failed_cascade(e)
             else:
-                df.at[index, self.topic_name] = topic
+                answer = self.accept(answer)
+            if answer is not None:
+                return answer
+        return self.ask(transcript, system_prompt)
 
-        with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = [executor.submit(process_row, index, row) for index, row in df.iterrows()]
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Classifying"):
-                update_df(future.result())
-        
-        initial = len(df)
-        df = df[~(df[self.topic_name].str.contains('FAILED'))]
-        final = len(df)
+    def count_cascade(self, reason: str, rows: int = 1):
+        with self._cascade_lock:
+            self.cascade_counts[reason] += rows
+            if reason != 'accepted':
+                self.cascade_counts['escalated'] += rows
+
+    def normalize(self, answer):
+        # maps an answer to the exact topic name or 'no <category>', None when it names neither
+        if answer is None:
+            return None
+        label = answer.strip().strip('"\'.').lower()
+        if label == f"no {self.category}":
+            return label
+        return self.topic_lookup.get(label)
+
+    def accept(self, answer):
+        # the cascade model's answer only stands when it names one of the topics, otherwise the row is escalated
+        if answer is None:
+            self.count_cascade('unparsed')
+            return None
+        topic = self.normalize(answer)
+        if topic is None or topic == f"no {self.category}":
+            self.count_cascade('unknown_label' if topic is None else 'no_topic')
+            return None
+        self.count_cascade('accepted')
+        return topic
+
+    def parse_topic_id(self, content):
+        if not content:
+            return None
+        topic = self.topic_ids.get(content.strip())
+        if topic is None:
+            self.log(f"{datetime.now()}: Failed unknown {self.category} ID {content!r}")
+        return topic
+
+    def request_body(self, message_pkg, max_tokens: int = None, logit_bias: dict = None, cascade: bool = False):
+        body = {'model': self.cascade_model if cascade else self.azure_model,
+                'messages': message_pkg,
+                'temperature': self.temperature,
+                'max_tokens': max_tokens or self.max_reply_tokens}
+        if logit_bias:
+            body['logit_bias'] = logit_bias
+        return body
+
+    def complete(self, message_pkg, max_tokens: int = None, logit_bias: dict = None, cascade: bool = False):
+        options = {'logit_bias': logit_bias} if logit_bias else None
+        if cascade:
+            return self.chat(message_pkg, 'classify_cascade', max_tokens, self.cascade_model, self.cascade_client, options)
+        return self.chat(message_pkg, 'classify', max_tokens, options=options)
+
+    def match_by_embedding(self, items, topic_vectors):
+        # only trust the nearest topic when it clearly beats the runner-up, the rest go to the model
+        best, margin = nearest_topics(self.embedder.embed([transcript for _, transcript in items]), topic_vectors)
+        confident = margin >= self.embedding_margin
+        matched = [(position, self.topics[topic]) for (position, _), topic, sure in zip(items, best, confident) if sure]
+        fallback = [item for item, sure in zip(items, confident) if not sure]
+        return matched, fallback
+
+    def assign_by_embedding(self, items):
+        # with no topics there is nothing to match against, so every row goes to the model
+        if not items or not self.topics:
+            return items
+        matched, fallback = self.match_by_embedding(items, self.embedder.embed(self.topics))
+        for position, topic in matched:
+            self.record(position, topic)
+        self.embedding_assigned = len(matched)
+        self.log(f"{datetime.now()}: Assigned {self.embedding_assigned} Transcripts by embedding, sending {len(fallback)} to the model")
+        return fallback
+
+    def pending_items(self):
+        items = super().pending_items()
+        if self.embedder:
+            items = self.assign_by_embedding(items)
+        return items
+
+    def finish(self, start_time: datetime):
+        if self.journal:
+            self.journal.close()
+        if self.groups:
+            self.results.broadcast(self.groups)
+        values = self.results.values
+        values[values == f"no {self.category}"] = f"No {self.category.title()}"
+        self.results.assign(self.dataframe, self.topic_name, categorical=True)
         end_time = datetime.now()
-        self.log(f"{end_time}: Finish Classifying {len(df)} Transcripts")
-        self.log(f"Dropped {initial-final} Transcripts for Error")
+        self.log(f"{end_time}: Finish Classifying {self.results.count(OK)} Transcripts")
+        self.log(f"Failed {self.results.count(FAILED)} Transcripts, skipped {self.results.count(SKIPPED)}")
+        if self.cascade_model:
+            counts = self.cascade_counts
+            self.log(f"Cascade settled {counts['accepted']} Transcripts with {self.cascade_model} and escalated {counts['escalated']} to {self.azure_model}: "
+                     f"{counts['no_topic']} no {self.category}, {counts['unknown_label']} unknown labels, {counts['unparsed']} unparsed, {counts['failed']} failed")
         self.log(f"Total Classification Time: {end_time-start_time}")
         self.duration = end_time-start_time
 
-        df[self.topic_name] = df[self.topic_name].apply(lambda x: f"No {self.category.title()}" if x==f"no {self.category}" else x)
+    def classify_items(self, items, system_prompt, escalated: bool = False):
+
+        # escalated rows have already been past the cascade model and go straight to azure_model
+        classify = self.ask if escalated else self.classify_transcript
+
+        def process_row(position, transcript):
+            try:
+                result = classify(transcript, system_prompt)
+                return position, result
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED with exception {e}")
+                return position, None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for result in tqdm(bounded_map(executor, process_row, items, self.workers*2), total=len(items), desc="Classifying"):
+                self.record(*result)
+
+    def classify_topics(self):
+
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin Classifying {len(self.dataframe)} Transcripts")
+
+        system_prompt = self.build_system_prompt()
+
+        if self.batch_size > 1:
+            self.classify_batches(system_prompt)
+        else:
+            self.classify_items(self.pending_items(), system_prompt)
+
+        self.finish(start_time)
+
+    def batch_classify_topics(self, runner: BatchRunner):
+
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin batch Classifying {len(self.dataframe)} Transcripts")
+
+        # the Batch API prices per token, so every text gets its own single-row request
+        system_prompt = self.build_system_prompt()
+
+        def request(transcript, cascade):
+            if self.constrained:
+                return self.request_body(self.build_constrained_messages(transcript, system_prompt), max_tokens=1, logit_bias=self.logit_bias, cascade=cascade)
+            return self.request_body(self.build_messages(transcript, system_prompt), cascade=cascade)
 
-        self.dataframe = df
\ No newline at end of file
+        # with a cascade, the rows the cascade model's batch cannot settle go out again in a second batch
+        retry = self.pending_items()
+        for cascade in ([True, False] if self.cascade_model else [False]):
+            answered, rejected = set(), 0
+            requests = ((position, request(transcript, cascade)) for position, transcript in retry)
+            for custom_id, content in runner.run('classify', requests, self.cache):
+                answer = content
+                if content is not None and self.constrained:
+                    answer = self.parse_topic_id(content)
+                if cascade:
+                    if content is None:
+                        self.count_cascade('failed')
+                    else:
+                        answer = self.accept(answer)
+                    rejected += answer is None
+                if answer is not None:
+                    self.record(int(custom_id), answer)
+                    answered.add(int(custom_id))
+            if cascade:
+                # rows the batch lost never reached accept
+                lost = len(retry) - len(answered) - rejected
+                if lost:
+                    self.count_cascade('failed', lost)
+            retry = [(position, transcript) for position, transcript in retry if position not in answered]
+
+        # whatever the batch failed or lost goes through the interactive path
+        if retry:
+            self.log(f"{datetime.now()}: Retrying {len(retry)} Transcripts the batch did not answer")
+            self.classify_items(retry, system_prompt, escalated=bool(self.cascade_model))
+
+        self.finish(start_time)
+
+    def classify_batches(self, system_prompt):
+
+        batch_prompt = self.build_batch_system_prompt()
+        items = self.pending_items()
+        batches = self.build_batches(items, batch_prompt)
+        self.log(f"{datetime.now()}: Packed {len(items)} Transcripts into {len(batches)} Batches")
+
+        def process_batch(batch):
+            try:
+                answers = self.classify_batch([transcript for _, transcript in batch], batch_prompt, system_prompt)
+                return [(position, answer) for (position, _), answer in zip(batch, answers)]
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED with exception {e}")
+                return [(position, None) for position, _ in batch]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            with tqdm(total=len(items), desc="Classifying") as progress:
+                for results in bounded_map(executor, process_batch, ((batch,) for batch in batches), self.workers*2):
+                    for position, topic in results:
+                        self.record(position, topic)
+                    progress.update(len(results))
@@ -1,9 +1,16 @@
 import pandas as pd
 from openai import AzureOpenAI
 from datetime import datetime
-import tiktoken
-
-class Condenser:
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .metrics import Metrics
+from .stage import ChatStage
+from . import tokens
+from .logwriter import get_log_writer
+
+class Condenser(ChatStage):
     def __init__(self,
             dataframe: pd.DataFrame,
             azure_client: AzureOpenAI,
@@ -14,8 +21,17 @@ class Condenser:
             log_path: str = f'./logs',
             temperature: float = 0,
             max_reply_tokens: int = 4000,
-            max_input_tokens: int = 20000
+            max_input_tokens: int = 20000,
+            cache: ResponseCache = None,
+            rate_limiter: RateLimiter = None,
+            token_counts: pd.Series = None,
+            workers: int = 1,
+            fan_in: int = 4,
+            metrics: Metrics = None,
+            encoding_name: str = 'cl100k_base'
             ):
+        if fan_in < 2:
+            raise ValueError(f"fan_in must be at least 2, got {fan_in}")
         self.dataframe = dataframe
         self.azure_client = azure_client
         self.azure_model = azure_model
@@ -23,27 +39,41 @@ class Condenser:
         self.num_topics = num_topics
         self.topic = topic
         self.log_path = log_path
+        self.logger = get_log_writer(log_path)
         self.temperature = temperature
         self.max_reply_tokens = max_reply_tokens
         self.max_input_tokens = max_input_tokens
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+        self.token_counts = token_counts
+        self.workers = workers
+        self.fan_in = fan_in
+        self.encoding_name = encoding_name
         self.common_topics = None
         self.duration = None
     
     def log(self, input):
-        print(input, file=open(f'{self.log_path}/{datetime.now().date()}.txt', 'a'))
+        self.logger.log(type(self).__name__, input)
 
     def count_tokens(self, text):
-        encoding = tiktoken.get_encoding("cl100k_base")
-        token_count = encoding.encode(text)
-
-        return len(token_count)
+        return tokens.count_tokens(text, self.encoding_name)
+
+    def texts(self):
+        # rows whose upstream stage failed or was skipped have no text to condense
+        return self.dataframe[self.target_column].dropna()
+
+    def compute_token_counts(self):
+        # one batched encode of the target column, reused for every sample and by later stages
+        if self.token_counts is None:
+            texts = self.texts()
+            self.token_counts = pd.Series(tokens.count_tokens_batch(texts.tolist(), self.encoding_name), index=texts.index)
+        return self.token_counts
     
     def clean_results(self, results):
         return [result.split('.')[1].split('(')[0].strip() for result in results]
     
-    def condense_topics_from_dataframe(self):
-
-        df = self.dataframe
+    def build_system_prompt(self):
 
         if self.topic:
             context_string = f" These topics were all initially categorized as {self.topic}. All topics should be subtopics of {self.topic}"
@@ -52,7 +82,7 @@ class Condenser:
             context_string = ""
             rule_string = ""
         
-        system_prompt = f"""
+        return f"""
         Given the following topics, try and combine them into a single set of COMMON topics. You can merge common topics together.{context_string}
 
         Rules:
@@ -61,28 +91,52 @@ class Condenser:
         - rank more common topics higher than less common topics
         {rule_string}
         """
-        start_time = datetime.now()
-        self.log(f'{start_time}: Begin condensing topics')
 
+    def sample_batches(self, count: int = 3):
 
-        # gather a sample size that is as large as can reasonably be achieved 
-        sample_size = len(df)
-        while True:
-            if self.count_tokens(str(df[self.target_column].sample(sample_size).tolist())) < self.max_input_tokens: break
-            sample_size = sample_size*3//4
+        texts = self.texts()
+        counts = self.compute_token_counts().to_numpy()
 
-        first_batch = df[self.target_column].sample(sample_size).tolist()
-        second_batch = df[self.target_column].sample(sample_size).tolist()
-        third_batch = df[self.target_column].sample(sample_size).tolist()
+        # shuffle, then take the longest prefix whose running token total fits the budget;
+        # each item also pays for the quotes, comma and space str(list) wraps it in
+        batches = []
+        for _ in range(count):
+            order = np.random.permutation(len(texts))
+            cumulative = np.cumsum(counts[order] + 3)
+            sample_size = max(1, int(np.searchsorted(cumulative, self.max_input_tokens, side='right')))
+            batches.append(texts.iloc[order[:sample_size]].tolist())
 
-        # Call the generate_overarching_topics function with the list of all topics
-        first_condensed = self.condense_topics_openai_call(first_batch, system_prompt).split("\n")
-        second_condensed = self.condense_topics_openai_call(second_batch, system_prompt).split("\n")
-        third_condensed = self.condense_topics_openai_call(third_batch, system_prompt).split("\n")
+        return batches
 
-        final_batch = first_condensed + second_condensed + third_condensed
+    def shard_batches(self):
 
-        final_condensed = self.condense_topics_openai_call(final_batch).split('\n')
+        texts = self.texts()
+        cumulative = np.cumsum(self.compute_token_counts().to_numpy() + 3)
+
+        # walk the whole column in order, cutting a shard wherever the running total passes the budget
+        shards = []
+        start, consumed = 0, 0
+        while start < len(texts):
+            end = max(start + 1, int(np.searchsorted(cumulative, consumed + self.max_input_tokens, side='right')))
+            shards.append(texts.iloc[start:end].tolist())
+            consumed = cumulative[end - 1]
+            start = end
+
+        return shards
+
+    def split_results(self, results):
+        partials = []
+        for result in results:
+            if result is None:
+                self.log('Dropping a topic list that failed to condense')
+                continue
+            partials.append(result.split("\n"))
+        return partials
+
+    def merge_groups(self, partials):
+        return [sum(partials[i:i+self.fan_in], []) for i in range(0, len(partials), self.fan_in)]
+
+    def finish(self, final_condensed, start_time: datetime):
 
         clean = self.clean_results(final_condensed)
 
@@ -93,8 +147,45 @@ class Condenser:
         self.log(f'List of topics: {clean}')
 
         self.common_topics = clean
+
+    def condense_topics_from_dataframe(self):
+
+        system_prompt = self.build_system_prompt()
+        start_time = datetime.now()
+        self.log(f'{start_time}: Begin condensing topics')
+
+        first_batch, second_batch, third_batch = self.sample_batches()
+
+        # Call the generate_overarching_topics function with the list of all topics
+        first_condensed = self.condense_topics_openai_call(first_batch, system_prompt).split("\n")
+        second_condensed = self.condense_topics_openai_call(second_batch, system_prompt).split("\n")
+        third_condensed = self.condense_topics_openai_call(third_batch, system_prompt).split("\n")
+
+        final_batch = first_condensed + second_condensed + third_condensed
+
+        final_condensed = self.condense_topics_openai_call(final_batch).split('\n')
+
+        self.finish(final_condensed, start_time)
     
-    def condense_topics_openai_call(self, topics_list, system_prompt=None):
+    def map_reduce_topics_from_dataframe(self):
+
+        system_prompt = self.build_system_prompt()
+        start_time = datetime.now()
+        shards = self.shard_batches()
+        self.log(f'{start_time}: Begin map-reduce condensing of {len(shards)} shards')
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            partials = self.split_results(executor.map(lambda shard: self.condense_topics_openai_call(shard, system_prompt), shards))
+            # merge fan_in lists at a time until one is left; always merge at least
+            # once so the final list carries the "Topic (examples)" format
+            while True:
+                partials = self.split_results(executor.map(self.condense_topics_openai_call, self.merge_groups(partials)))
+                self.log(f'{datetime.now()}: Reduced to {len(partials)} topic lists')
+                if len(partials) <= 1: break
+
+        self.finish(partials[0] if partials else [], start_time)
+    
+    def build_messages(self, topics_list, system_prompt=None):
     # Join the list of topics into a single string separated by commas
         if not system_prompt:
             system_prompt = f"""
@@ -119,20 +210,12 @@ class Condenser:
 
         self.log(f"Topics Token Count: {self.count_tokens(topics_str)}")
 
-        message_pkg = [{"role": "system", "content": system_prompt},
-                    {"role": "user", "content": topics_str}]
+        return [{"role": "system", "content": system_prompt},
+                {"role": "user", "content": topics_str}]
 
-
-        # Add try-except error catching here
+    def condense_topics_openai_call(self, topics_list, system_prompt=None):
         try:
-            response = self.azure_client.chat.completions.create(
-                # model="gpt-35-turbo-16k",
-                model=self.azure_model,
-                messages=message_pkg,
-                temperature=self.temperature,
-                max_tokens=self.max_reply_tokens,
-            )
-            return response.choices[0].message.content
+            return self.chat(self.build_messages(topics_list, system_prompt), 'condense')
         except Exception as e:
             self.log(f"An error occurred: {e}")
             return None
\ No newline at end of file
@@ -0,0 +1,84 @@
+import hashlib
+import re
+import zlib
+import numpy as np
+import pandas as pd
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', str(text)).strip().lower()
+
+def content_hash(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+def shingles(text, shingle_size: int = 5):
+    text = normalize_text(text)
+    if len(text) <= shingle_size:
+        return {text}
+    return {text[i:i+shingle_size] for i in range(len(text) - shingle_size + 1)}
+
+def minhash_signature(text, permutations, shingle_size: int = 5):
+    a, b = permutations
+    hashes = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(text, shingle_size)], dtype=np.uint64)
+    # (a*h + b) mod p for every permutation/shingle pair, then keep the minimum per permutation
+    return ((np.outer(hashes, a) + b) % MERSENNE_PRIME).min(axis=0)
+
+def choose_bands(num_perm: int, threshold: float):
+    # pick the band/row split whose LSH collision threshold (1/b)^(1/r) sits closest to the requested similarity
+    options = [(bands, num_perm//bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1/option[0])**(1/option[1]) - threshold))
+
+def group_duplicates(texts: pd.Series,
+        near_duplicate_threshold: float = None,
+        shingle_size: int = 5,
+        num_perm: int = 64,
+        seed: int = 0):
+    # maps the position of each group's representative row to the positions of every row in the group
+    by_hash = {}
+    for position, text in enumerate(texts.tolist()):
+        by_hash.setdefault(content_hash(text), []).append(position)
+    groups = {members[0]: members for members in by_hash.values()}
+
+    if not near_duplicate_threshold or len(groups) < 2:
+        return groups
+
+    representatives = list(groups)
+    rng = np.random.default_rng(seed)
+    permutations = (rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64),
+                    rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64))
+    signatures = np.vstack([minhash_signature(texts.iloc[position], permutations, shingle_size) for position in representatives])
+
+    parent = list(range(len(representatives)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands, rows = choose_bands(num_perm, near_duplicate_threshold)
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(row.tobytes() for row in signatures[:, band*rows:(band+1)*rows]):
+            buckets.setdefault(key, []).append(i)
+        for candidates in buckets.values():
+            first = candidates[0]
+            for other in candidates[1:]:
+                if find(first) != find(other) and (signatures[first] == signatures[other]).mean() >= near_duplicate_threshold:
+                    parent[max(find(first), find(other))] = min(find(first), find(other))
+
+    clusters = {}
+    for i, position in enumerate(representatives):
+        clusters.setdefault(representatives[find(i)], []).extend(groups[position])
+    return clusters
+
+def broadcast_results(values: np.ndarray, groups):
+    # copy each representative's result to the rest of its group, by position
+    representatives, members = [], []
+    for representative, group in groups.items():
+        for member in group:
+            if member != representative:
+                representatives.append(representative)
+                members.append(member)
+    if members:
+        values[members] = values[representatives]
@@ -0,0 +1,28 @@
+import asyncio
+from concurrent.futures import Executor, FIRST_COMPLETED, as_completed, wait
+
+# Submitting every row up front holds one future per row for the whole run.
+# These helpers keep at most `window` submissions outstanding and yield results
+# in completion order as the window drains.
+
+def bounded_map(executor: Executor, fn, items, window: int):
+    pending = set()
+    for item in items:
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, *item))
+    for future in as_completed(pending):
+        yield future.result()
+
+async def abounded_map(fn, items, window: int):
+    pending = set()
+    for item in items:
+        if len(pending) >= window:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+        pending.add(asyncio.ensure_future(fn(*item)))
+    for task in asyncio.as_completed(pending):
+        yield await task
@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import openai
+from openai import AzureOpenAI
+from .cache import EmbeddingCache
+from .ratelimit import retry_after_seconds
+
+def azure_embed_fn(azure_client: AzureOpenAI, model: str, max_attempts: int = 6):
+    # wraps an embeddings deployment as fn(list of texts) -> array of shape (len(texts), dimensions)
+    def embed(texts):
+        for attempt in range(max_attempts):
+            try:
+                response = azure_client.embeddings.create(model=model, input=texts)
+                break
+            except openai.RateLimitError as e:
+                if attempt == max_attempts - 1:
+                    raise
+                delay = retry_after_seconds(e)
+                time.sleep(delay if delay is not None else min(2**attempt, 60))
+        return np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+    return embed
+
+def nearest_topics(text_vectors, topic_vectors):
+    # rows are unit length, so the dot product is the cosine similarity
+    similarities = text_vectors @ topic_vectors.T
+    best = similarities.argmax(axis=1)
+    if similarities.shape[1] < 2:
+        return best, np.full(len(best), np.inf)
+    top_two = -np.partition(-similarities, 1, axis=1)[:, :2]
+    return best, top_two[:, 0] - top_two[:, 1]
+
+class Embedder:
+    def __init__(self,
+            embed_fn,
+            model: str = 'default',
+            cache: EmbeddingCache = None,
+            batch_size: int = 256
+            ):
+        self.embed_fn = embed_fn
+        self.model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.calls = 0
+
+    def embed(self, texts):
+        texts = [str(text) for text in texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        vectors = {}
+        if self.cache:
+            keys = {text: self.cache.make_key(self.model, text) for text in set(texts)}
+            cached = self.cache.get_many(list(keys.values()))
+            vectors = {text: cached[key] for text, key in keys.items() if key in cached}
+
+        # embed each distinct uncached text once, batch_size texts per call
+        missing = [text for text in dict.fromkeys(texts) if text not in vectors]
+        computed = {}
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start+self.batch_size]
+            computed.update(zip(batch, np.asarray(self.embed_fn(batch), dtype=np.float32)))
+            self.calls += 1
+        if self.cache and computed:
+            self.cache.set_many({keys[text]: vector for text, vector in computed.items()})
+        vectors.update(computed)
+
+        matrix = np.vstack([vectors[text] for text in texts])
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
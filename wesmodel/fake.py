@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+import openai
+
+# Stand-ins for AzureOpenAI / AsyncAzureOpenAI that answer the pipeline's own
+# prompts without a network. Latency, 429s and reply truncation are simulated
+# so throughput can be measured on a laptop without spending quota.
+
+DEFAULT_TOPICS = ['Billing', 'Shipping', 'Returns', 'Account Access', 'Product Quality',
+                  'Pricing', 'Technical Support', 'Cancellations', 'Delivery Delays', 'Refunds']
+
+def rate_limit_error(retry_after: float = None):
+    headers = {} if retry_after is None else {'retry-after': str(retry_after)}
+    response = SimpleNamespace(status_code=429, headers=headers, request=None)
+    return openai.RateLimitError('Rate limit exceeded (simulated)', response=response, body=None)
+
+def stable_choice(text: str, options):
+    digest = hashlib.md5(text.encode('utf-8')).digest()
+    return options[int.from_bytes(digest[:4], 'little') % len(options)]
+
+def pick_topic(text: str, topics):
+    lowered = text.lower()
+    for topic in topics:
+        if topic.lower() in lowered:
+            return topic
+    return stable_choice(text, topics)
+
+def section(prompt: str, start: str, end: str):
+    match = re.search(re.escape(start) + r'(.*?)' + re.escape(end), prompt, re.S)
+    return match.group(1).strip() if match else ''
+
+def default_responder(messages, topics=DEFAULT_TOPICS):
+    system, user = messages[0]['content'], messages[-1]['content']
+
+    if 'IDs:' in system:
+        # constrained classification: the numbered list is in the system prompt and the reply is an ID
+        ids = dict(re.findall(r'^\s*(\d+)\. (.+?)\s*$', system.split('IDs:', 1)[1], re.M))
+        if not ids:
+            return '0'
+        topic = pick_topic(user, list(ids.values()))
+        return next(number for number, candidate in ids.items() if candidate == topic)
+
+    if 'Combined Topics:' in user:
+        count = int(re.search(r'maximum (\d+)', system).group(1)) if re.search(r'maximum (\d+)', system) else len(topics)
+        return '\n'.join(f"{number}. {topic} (example of {topic.lower()})" for number, topic in enumerate(topics[:count], 1))
+
+    if 'Assigned Topics:' in user:
+        candidates = section(user, 'Topics:', 'Pieces of Text:').split('|')
+        items = re.split(r'\n\s*\n', section(user, 'Pieces of Text:', 'Assigned Topics:'))
+        answers = []
+        for item in items:
+            match = re.match(r'\s*(\d+)\.\s*(.*)', item, re.S)
+            if match:
+                answers.append(f"{match.group(1)}. {pick_topic(match.group(2), candidates)}")
+        return '\n'.join(answers)
+
+    if 'Assigned Topic:' in user:
+        candidates = section(user, 'Topics:', 'Piece of Text:').split('|')
+        return pick_topic(section(user, 'Piece of Text:', 'Assigned Topic:'), candidates)
+
+    # anything else is treated as a summarization request
+    return ' '.join(user.split()[:25])
+
+def approximate_tokens(text: str):
+    return max(1, len(text)//4)
+
+class FakeCompletions:
+    def __init__(self, client):
+        self.client = client
+
+    def _respond(self, messages, max_tokens):
+        content = self.client.responder(messages)
+        words = content.split(' ')
+        finish_reason = 'stop'
+        if max_tokens and len(words) > max_tokens:
+            content = ' '.join(words[:max_tokens])
+            finish_reason = 'length'
+        prompt_tokens = sum(approximate_tokens(message['content']) for message in messages)
+        completion_tokens = min(len(words), max_tokens or len(words))
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=SimpleNamespace(role='assistant', content=content), finish_reason=finish_reason)],
+                               usage=SimpleNamespace(prompt_tokens=prompt_tokens,
+                                                     completion_tokens=completion_tokens,
+                                                     total_tokens=prompt_tokens + completion_tokens))
+
+    def create(self, model=None, messages=None, temperature=None, max_tokens=None, **kwargs):
+        throttle = self.client._begin()
+        try:
+            time.sleep(self.client.sample_latency())
+            if throttle:
+                raise rate_limit_error(self.client.retry_after)
+            return self._respond(messages, max_tokens)
+        finally:
+            self.client._end()
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, model=None, messages=None, temperature=None, max_tokens=None, **kwargs):
+        throttle = self.client._begin()
+        try:
+            await asyncio.sleep(self.client.sample_latency())
+            if throttle:
+                raise rate_limit_error(self.client.retry_after)
+            return self._respond(messages, max_tokens)
+        finally:
+            self.client._end()
+
+class FakeAzureOpenAI:
+    _completions = FakeCompletions
+
+    def __init__(self,
+            latency=0.05,
+            latency_sigma: float = 0.0,
+            rate_limit_rate: float = 0.0,
+            max_concurrency: int = None,
+            retry_after: float = None,
+            responder=None,
+            seed: int = None
+            ):
+        # latency is either a callable returning seconds or the median of a lognormal with latency_sigma spread
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.responder = responder or default_responder
+        self.calls = 0
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self._completions(self))
+
+    def sample_latency(self):
+        if callable(self.latency):
+            return max(0.0, self.latency())
+        with self._lock:
+            if not self.latency_sigma:
+                return self.latency
+            return self._random.lognormvariate(0, self.latency_sigma) * self.latency
+
+    def _begin(self):
+        # decide up front whether this request will be answered with a 429
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            throttle = (self.max_concurrency is not None and self.in_flight > self.max_concurrency) or \
+                       (self.rate_limit_rate and self._random.random() < self.rate_limit_rate)
+            if throttle:
+                self.throttled += 1
+            return throttle
+
+    def _end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls,
+                    'throttled': self.throttled,
+                    'peak_in_flight': self.peak_in_flight}
+
+class FakeAsyncAzureOpenAI(FakeAzureOpenAI):
+    _completions = FakeAsyncCompletions
+
+class FakeBatchTransport:
+    # stands in for the Batch API: each uploaded file is answered by the simulated client
+    # once the batch has been polled `polls` times
+    def __init__(self,
+            responder=None,
+            error_rate: float = 0.0,
+            polls: int = 1,
+            final_status: str = 'completed',
+            seed: int = None
+            ):
+        self.endpoint = '/chat/completions'
+        self.client = FakeAzureOpenAI(latency=0, responder=responder)
+        self.error_rate = error_rate
+        self.polls = polls
+        self.final_status = final_status
+        self.files = {}
+        self.batches = {}
+        self._random = random.Random(seed)
+
+    def upload(self, path: str):
+        file_id = f'file-{len(self.files)}'
+        with open(path, 'r', encoding='utf-8') as file:
+            self.files[file_id] = file.read()
+        return file_id
+
+    def submit(self, file_id: str):
+        batch_id = f'batch-{len(self.batches)}'
+        self.batches[batch_id] = {'input_file_id': file_id, 'status': 'in_progress', 'polls': 0,
+                                  'output_file_id': None, 'error_file_id': None}
+        return batch_id
+
+    def _save(self, lines):
+        if not lines:
+            return None
+        file_id = f'file-{len(self.files)}'
+        self.files[file_id] = ''.join(json.dumps(line) + '\n' for line in lines)
+        return file_id
+
+    def _finish(self, batch):
+        batch['status'] = self.final_status
+        if self.final_status != 'completed':
+            return
+        output, errors = [], []
+        for number, line in enumerate(self.files[batch['input_file_id']].splitlines()):
+            request = json.loads(line)
+            if self._random.random() < self.error_rate:
+                errors.append({'id': f'response-{number}', 'custom_id': request['custom_id'],
+                               'response': {'status_code': 500, 'body': {'error': {'message': 'Simulated failure'}}}, 'error': None})
+                continue
+            response = self.client.chat.completions.create(**request['body'])
+            choice = response.choices[0]
+            output.append({'id': f'response-{number}', 'custom_id': request['custom_id'], 'error': None,
+                           'response': {'status_code': 200,
+                                        'body': {'choices': [{'index': 0,
+                                                              'message': {'role': 'assistant', 'content': choice.message.content},
+                                                              'finish_reason': choice.finish_reason}],
+                                                 'usage': vars(response.usage)}}})
+        batch['output_file_id'] = self._save(output)
+        batch['error_file_id'] = self._save(errors)
+
+    def status(self, batch_id: str):
+        batch = self.batches[batch_id]
+        batch['polls'] += 1
+        if batch['status'] == 'in_progress' and batch['polls'] >= self.polls:
+            self._finish(batch)
+        return {'status': batch['status'],
+                'output_file_id': batch['output_file_id'],
+                'error_file_id': batch['error_file_id']}
+
+    def download(self, file_id: str, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.files[file_id])
+
+    def cancel(self, batch_id: str):
+        self.batches[batch_id]['status'] = 'cancelled'
@@ -0,0 +1,95 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Every stage used to open the day's log file for each line it wrote. A
+# LogWriter instead takes records on an unbounded queue, so callers never wait
+# on the disk, and a single background thread appends them as JSON lines to
+# `{log_path}/{date}.jsonl` through one held file handle.
+
+_STOP = object()
+
+class LogWriter:
+    def __init__(self, log_path: str = f'./logs', flush_interval: float = 1.0):
+        if not os.path.exists(log_path):
+            os.makedirs(log_path)
+        self.log_path = log_path
+        self.flush_interval = flush_interval
+        self.closed = False
+        self._queue = queue.SimpleQueue()
+        self._file = None
+        self._date = None
+        self._thread = threading.Thread(target=self._run, name='wesmodel-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, source: str, message):
+        if self.closed:
+            return
+        self._queue.put({'time': datetime.now().isoformat(), 'source': source, 'message': str(message)})
+
+    def flush(self):
+        # wait until everything queued so far is on disk
+        if self.closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _write(self, record):
+        date = record['time'][:10]
+        if date != self._date:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(f'{self.log_path}/{date}.jsonl', 'a', encoding='utf-8')
+            self._date = date
+        self._file.write(json.dumps(record) + '\n')
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is _STOP:
+                break
+            if isinstance(record, threading.Event):
+                if self._file is not None:
+                    self._file.flush()
+                record.set()
+            elif record is not None:
+                try:
+                    self._write(record)
+                except OSError as e:
+                    print(f"wesmodel could not write to {self.log_path}: {e}", file=sys.stderr)
+            if self._file is not None and time.monotonic() - last_flush >= self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_log_writer(log_path: str = f'./logs'):
+    # one writer per log directory, shared by every stage that logs there
+    key = os.path.abspath(log_path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or writer.closed:
+            writer = _writers[key] = LogWriter(log_path)
+        return writer
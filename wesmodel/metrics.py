@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from array import array
+import numpy as np
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+class CallTimer:
+    # tracks one API call across its retries; queued time is everything not spent waiting on the API
+    def __init__(self, metrics, stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.started = time.perf_counter()
+        self.in_flight = 0.0
+        self.retries = 0
+        self._sent = None
+
+    def sent(self):
+        self._sent = time.perf_counter()
+
+    def _received(self):
+        now = time.perf_counter()
+        if self._sent is not None:
+            self.in_flight += now - self._sent
+            self._sent = None
+        return now
+
+    def throttled(self):
+        self._received()
+        self.retries += 1
+
+    def failed(self):
+        self._finish(self._received(), None, failed=True)
+
+    def succeeded(self, response):
+        self._finish(self._received(), response, failed=False)
+
+    def _finish(self, now, response, failed):
+        usage = getattr(response, 'usage', None)
+        self.metrics.record(self.stage,
+                            latency=now - self.started,
+                            queued=now - self.started - self.in_flight,
+                            in_flight=self.in_flight,
+                            prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+                            completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+                            retries=self.retries,
+                            failed=failed)
+
+class StageMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = array('d')
+        self.queued = array('d')
+        self.in_flight = array('d')
+
+    def summary(self):
+        summary = {'calls': self.calls,
+                   'failures': self.failures,
+                   'retries': self.retries,
+                   'cache_hits': self.cache_hits,
+                   'prompt_tokens': self.prompt_tokens,
+                   'completion_tokens': self.completion_tokens}
+        for name in ('latency', 'queued', 'in_flight'):
+            samples = np.array(getattr(self, name), dtype=np.float64)
+            if len(samples):
+                values = np.quantile(samples, QUANTILES)
+                summary[name] = {'mean': float(samples.mean()),
+                                 'max': float(samples.max()),
+                                 'sum': float(samples.sum()),
+                                 **{f'p{int(q*100)}': float(value) for q, value in zip(QUANTILES, values)}}
+            else:
+                summary[name] = None
+        return summary
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def _stage(self, stage: str):
+        if stage not in self.stages:
+            self.stages[stage] = StageMetrics()
+        return self.stages[stage]
+
+    def start(self, stage: str):
+        return CallTimer(self, stage)
+
+    def cache_hit(self, stage: str):
+        with self._lock:
+            self._stage(stage).cache_hits += 1
+
+    def record(self, stage: str,
+            latency: float,
+            queued: float,
+            in_flight: float,
+            prompt_tokens: int = 0,
+            completion_tokens: int = 0,
+            retries: int = 0,
+            failed: bool = False):
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.calls += 1
+            metrics.failures += int(failed)
+            metrics.retries += retries
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+            metrics.latency.append(latency)
+            metrics.queued.append(queued)
+            metrics.in_flight.append(in_flight)
+
+    def summary(self):
+        with self._lock:
+            return {stage: metrics.summary() for stage, metrics in self.stages.items()}
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def to_json(self, path: str = None):
+        content = json.dumps(self.summary(), indent=2)
+        if path:
+            write_atomic(path, content)
+        return content
+
+    def to_prometheus(self, path: str = None):
+        summary = self.summary()
+        lines = []
+        counters = [('requests_total', 'calls', 'API requests sent'),
+                    ('request_failures_total', 'failures', 'API requests that failed'),
+                    ('request_retries_total', 'retries', 'Retries after a 429'),
+                    ('cache_hits_total', 'cache_hits', 'Responses served from the cache'),
+                    ('prompt_tokens_total', 'prompt_tokens', 'Prompt tokens reported by the API'),
+                    ('completion_tokens_total', 'completion_tokens', 'Completion tokens reported by the API')]
+        for name, field, description in counters:
+            lines += [f'# HELP wesmodel_{name} {description}', f'# TYPE wesmodel_{name} counter']
+            lines += [f'wesmodel_{name}{{stage="{stage}"}} {stats[field]}' for stage, stats in summary.items()]
+        timings = [('request_latency_seconds', 'latency', 'Wall time of an API call including retries'),
+                   ('request_queued_seconds', 'queued', 'Time an API call spent waiting on the rate limiter and backoff'),
+                   ('request_in_flight_seconds', 'in_flight', 'Time an API call spent waiting on the API')]
+        for name, field, description in timings:
+            lines += [f'# HELP wesmodel_{name} {description}', f'# TYPE wesmodel_{name} summary']
+            for stage, stats in summary.items():
+                if stats[field] is None:
+                    continue
+                lines += [f'wesmodel_{name}{{stage="{stage}",quantile="{q}"}} {stats[field][f"p{int(q*100)}"]}' for q in QUANTILES]
+                lines += [f'wesmodel_{name}_sum{{stage="{stage}"}} {stats[field]["sum"]}',
+                          f'wesmodel_{name}_count{{stage="{stage}"}} {stats["calls"]}']
+        content = '\n'.join(lines) + '\n'
+        if path:
+            write_atomic(path, content)
+        return content
+
+def write_atomic(path: str, content: str):
+    # textfile collectors may read at any moment, so never expose a half-written file
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(path + '.tmp', path)
@@ -1,11 +1,22 @@
 import pandas as pd
+import numpy as np
 from datetime import datetime
 from typing import List
 import os
-from openai import AzureOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from .summarize import Summarizer
 from .classify import Classifier
 from .condense import Condenser
+from .cache import ResponseCache
+from .ratelimit import RateLimiter, BoundedLimiter
+from .metrics import Metrics
+from .checkpoint import Checkpoint
+from .embed import Embedder
+from .batch import BatchRunner
+from .logwriter import get_log_writer
+from .pipeline import Pipeline
+from .aio import AsyncSummarizer, AsyncClassifier, AsyncCondenser
 
 class NLPTopicModeler:
     def __init__(self,
@@ -13,20 +24,55 @@ class NLPTopicModeler:
             azure_client: AzureOpenAI,
             azure_model: str,
             log_path: str = f'./logs',
+            cache: ResponseCache = None,
+            azure_async_client: AsyncAzureOpenAI = None,
+            rate_limiter: RateLimiter = None,
+            embedder: Embedder = None,
+            metrics: Metrics = None,
+            encoding_name: str = 'cl100k_base'
             ):
         self.dataframe = dataframe
         self.azure_client = azure_client
+        self.azure_async_client = azure_async_client
         self.azure_model = azure_model
         self.log_path = log_path
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.embedder = embedder
+        self.metrics = metrics or Metrics()
+        self.encoding_name = encoding_name
         if not os.path.exists(log_path):
             os.mkdir(log_path)
+        self.logger = get_log_writer(log_path)
+
+    def log(self, input: str):
+        self.logger.log(type(self).__name__, input)
+
+    def _child(self, dataframe: pd.DataFrame):
+        # a modeler over part of the data that shares this one's clients, cache, limiter and metrics
+        return NLPTopicModeler(dataframe=dataframe,
+                               azure_client=self.azure_client,
+                               azure_model=self.azure_model,
+                               log_path=self.log_path,
+                               cache=self.cache,
+                               azure_async_client=self.azure_async_client,
+                               rate_limiter=self.rate_limiter,
+                               embedder=self.embedder,
+                               metrics=self.metrics,
+                               encoding_name=self.encoding_name)
     
     def summarize(self,
             target_column: str,
             summary_column: str = 'summary',
             workers: int = 1,
             temperature: float = 0,
-            max_reply_tokens: int = 1000
+            max_reply_tokens: int = 1000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            batch_runner: BatchRunner = None
             ):
         summarizer = Summarizer(dataframe=self.dataframe,
                         azure_client=self.azure_client,
@@ -36,10 +82,22 @@ class NLPTopicModeler:
                         workers=workers,
                         log_path=self.log_path,
                         temperature=temperature,
-                        max_reply_tokens=max_reply_tokens
+                        max_reply_tokens=max_reply_tokens,
+                        cache=self.cache,
+                        rate_limiter=self.rate_limiter,
+                        metrics=self.metrics,
+                        dedup=dedup,
+                        near_duplicate_threshold=near_duplicate_threshold,
+                        journal=Checkpoint(checkpoint_path).journal(summary_column) if checkpoint_path else None,
+                        max_text_tokens=max_text_tokens,
+                        over_budget=over_budget,
+                        encoding_name=self.encoding_name
                         )
         
-        summarizer.bulk_summarize_transcripts()
+        if batch_runner:
+            summarizer.batch_summarize_transcripts(batch_runner)
+        else:
+            summarizer.bulk_summarize_transcripts()
 
         return summarizer
     
@@ -49,7 +107,10 @@ class NLPTopicModeler:
             topic: str = None,
             temperature: float = 0,
             max_reply_tokens: int = 4000,
-            max_input_tokens: int = 20000
+            max_input_tokens: int = 20000,
+            map_reduce: bool = False,
+            workers: int = 1,
+            fan_in: int = 4
             ):
         
         condenser = Condenser(dataframe=self.dataframe,
@@ -61,9 +122,18 @@ class NLPTopicModeler:
             log_path=self.log_path,
             temperature=temperature,
             max_reply_tokens=max_reply_tokens,
-            max_input_tokens=max_input_tokens)
+            max_input_tokens=max_input_tokens,
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+            workers=workers,
+            fan_in=fan_in,
+            encoding_name=self.encoding_name)
         
-        condenser.condense_topics_from_dataframe()
+        if map_reduce:
+            condenser.map_reduce_topics_from_dataframe()
+        else:
+            condenser.condense_topics_from_dataframe()
 
         return condenser
     
@@ -74,7 +144,20 @@ class NLPTopicModeler:
             category: str = 'topic',
             workers: int = 1,
             temperature: float = 0,
-            max_reply_tokens: int = 1000):
+            max_reply_tokens: int = 1000,
+            batch_size: int = 1,
+            batch_token_budget: int = 4000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            token_counts: pd.Series = None,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None,
+            batch_runner: BatchRunner = None):
         
         classifier = Classifier(dataframe=self.dataframe,
             azure_client=self.azure_client,
@@ -86,9 +169,29 @@ class NLPTopicModeler:
             workers=workers,
             log_path=self.log_path,
             temperature=temperature,
-            max_reply_tokens=max_reply_tokens)
+            max_reply_tokens=max_reply_tokens,
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+            batch_size=batch_size,
+            batch_token_budget=batch_token_budget,
+            dedup=dedup,
+            near_duplicate_threshold=near_duplicate_threshold,
+            journal=Checkpoint(checkpoint_path).journal(topic_name) if checkpoint_path else None,
+            max_text_tokens=max_text_tokens,
+            over_budget=over_budget,
+            token_counts=token_counts,
+            embedder=self.embedder,
+            embedding_margin=embedding_margin,
+            constrained=constrained,
+            cascade_model=cascade_model,
+            cascade_client=cascade_client,
+            encoding_name=self.encoding_name)
         
-        classifier.classify_topics()
+        if batch_runner:
+            classifier.batch_classify_topics(batch_runner)
+        else:
+            classifier.classify_topics()
 
         return classifier
     
@@ -103,33 +206,512 @@ class NLPTopicModeler:
             max_reply_tokens: int = 1000,
             num_topics: int = 15,
             topic: str = None,
-            max_input_tokens: int = 20000):
+            max_input_tokens: int = 20000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            map_reduce: bool = False,
+            fan_in: int = 4,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None,
+            pipelined: bool = False,
+            batch_runner: BatchRunner = None):
+
+        if pipelined and batch_runner:
+            raise ValueError('pipelined and batch_runner cannot be combined.')
+        if pipelined and not summarize_first:
+            raise ValueError('pipelined requires summarize_first.')
+
+        checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+        topics = checkpoint.load_topics(topic_name) if checkpoint else None
+
+        if pipelined:
+            return self.model_column_pipelined(target_column=target_column,
+                                               topic_name=topic_name,
+                                               summary_column=summary_column,
+                                               category=category,
+                                               workers=workers,
+                                               temperature=temperature,
+                                               max_reply_tokens=max_reply_tokens,
+                                               num_topics=num_topics,
+                                               topic=topic,
+                                               max_input_tokens=max_input_tokens,
+                                               dedup=dedup,
+                                               near_duplicate_threshold=near_duplicate_threshold,
+                                               checkpoint=checkpoint,
+                                               topics=topics,
+                                               max_text_tokens=max_text_tokens,
+                                               over_budget=over_budget,
+                                               map_reduce=map_reduce,
+                                               fan_in=fan_in,
+                                               embedding_margin=embedding_margin,
+                                               constrained=constrained,
+                                               cascade_model=cascade_model,
+                                               cascade_client=cascade_client)
 
         summarizer = None
         if summarize_first:
-            summarizier = self.summarize(target_column=target_column,
-                                        summary_column=summary_column,
-                                        workers=workers,
-                                        temperature=temperature,
-                                        max_reply_tokens=max_reply_tokens)
+            summarizer = self.summarize(target_column=target_column,
+                                       summary_column=summary_column,
+                                       workers=workers,
+                                       temperature=temperature,
+                                       max_reply_tokens=max_reply_tokens,
+                                       dedup=dedup,
+                                       near_duplicate_threshold=near_duplicate_threshold,
+                                       checkpoint_path=checkpoint_path,
+                                       max_text_tokens=max_text_tokens,
+                                       over_budget=over_budget,
+                                       batch_runner=batch_runner)
         if summarizer:
             self.dataframe=summarizer.dataframe
             target_column=summary_column
 
-        condenser = self.condense(target_column=target_column,
-                                  num_topics=num_topics,
-                                  topic=topic,
-                                  max_reply_tokens=max_reply_tokens,
-                                  max_input_tokens=max_input_tokens)
+        token_counts = None
+        if topics is None:
+            condenser = self.condense(target_column=target_column,
+                                      num_topics=num_topics,
+                                      topic=topic,
+                                      max_reply_tokens=max_reply_tokens,
+                                      max_input_tokens=max_input_tokens,
+                                      map_reduce=map_reduce,
+                                      workers=workers,
+                                      fan_in=fan_in)
+            topics = condenser.common_topics
+            token_counts = condenser.token_counts
+            if checkpoint:
+                checkpoint.save_topics(topic_name, topics)
         
-        classifier = self.classify(topics=condenser.common_topics,
+        classifier = self.classify(topics=topics,
                                    target_column=target_column,
                                    topic_name=topic_name,
                                    category=category,
                                    workers=workers,
                                    temperature=temperature,
-                                   max_reply_tokens=max_reply_tokens)
+                                   max_reply_tokens=max_reply_tokens,
+                                   dedup=dedup,
+                                   near_duplicate_threshold=near_duplicate_threshold,
+                                   checkpoint_path=checkpoint_path,
+                                   max_text_tokens=max_text_tokens,
+                                   over_budget=over_budget,
+                                   token_counts=token_counts,
+                                   embedding_margin=embedding_margin,
+                                   constrained=constrained,
+                                   cascade_model=cascade_model,
+                                   cascade_client=cascade_client,
+                                   batch_runner=batch_runner)
         
         self.dataframe=classifier.dataframe
 
+        return self.dataframe
+
+    def model_column_pipelined(self,
+            target_column: str,
+            topic_name: str = 'topic',
+            summary_column: str = 'summary',
+            category: str = 'topic',
+            workers: int = 1,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            num_topics: int = 15,
+            topic: str = None,
+            max_input_tokens: int = 20000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint: Checkpoint = None,
+            topics: List[str] = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            map_reduce: bool = False,
+            fan_in: int = 4,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None):
+
+        summarizer = Summarizer(dataframe=self.dataframe,
+                        azure_client=self.azure_client,
+                        azure_model=self.azure_model,
+                        target_column=target_column,
+                        summary_column=summary_column,
+                        workers=workers,
+                        log_path=self.log_path,
+                        temperature=temperature,
+                        max_reply_tokens=max_reply_tokens,
+                        cache=self.cache,
+                        rate_limiter=self.rate_limiter,
+                        metrics=self.metrics,
+                        dedup=dedup,
+                        near_duplicate_threshold=near_duplicate_threshold,
+                        journal=checkpoint.journal(summary_column) if checkpoint else None,
+                        max_text_tokens=max_text_tokens,
+                        over_budget=over_budget,
+                        encoding_name=self.encoding_name)
+
+        def make_condenser(dataframe):
+            return self._child(dataframe).condense(target_column=summary_column,
+                                                   num_topics=num_topics,
+                                                   topic=topic,
+                                                   max_reply_tokens=max_reply_tokens,
+                                                   max_input_tokens=max_input_tokens,
+                                                   map_reduce=map_reduce,
+                                                   workers=workers,
+                                                   fan_in=fan_in)
+
+        def make_classifier(dataframe, topics):
+            return Classifier(dataframe=dataframe,
+                              azure_client=self.azure_client,
+                              azure_model=self.azure_model,
+                              topics=topics,
+                              target_column=summary_column,
+                              topic_name=topic_name,
+                              category=category,
+                              workers=workers,
+                              log_path=self.log_path,
+                              temperature=temperature,
+                              max_reply_tokens=max_reply_tokens,
+                              cache=self.cache,
+                              rate_limiter=self.rate_limiter,
+                              metrics=self.metrics,
+                              journal=checkpoint.journal(topic_name) if checkpoint else None,
+                              embedder=self.embedder,
+                              embedding_margin=embedding_margin,
+                              constrained=constrained,
+                              cascade_model=cascade_model,
+                              cascade_client=cascade_client,
+                              encoding_name=self.encoding_name)
+
+        classifier = Pipeline(summarizer=summarizer,
+                              make_condenser=make_condenser,
+                              make_classifier=make_classifier,
+                              workers=workers,
+                              condense_tokens=max_input_tokens,
+                              topics=topics,
+                              checkpoint=checkpoint,
+                              topic_name=topic_name).run()
+
+        self.dataframe=classifier.dataframe
+
+        return self.dataframe
+
+    def model_hierarchy(self,
+            target_column: str,
+            depth: int = 2,
+            topic_names: List[str] = None,
+            summary_column: str = 'summary',
+            summarize_first: bool = False,
+            workers: int = 1,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            num_topics: int = 15,
+            num_subtopics: int = 5,
+            max_input_tokens: int = 20000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            map_reduce: bool = False,
+            fan_in: int = 4,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None):
+
+        levels = topic_names or [f"{'sub'*level}topic" for level in range(depth)]
+        if len(levels) != depth:
+            raise ValueError(f"topic_names must name {depth} columns, got {len(levels)}")
+
+        df = self.dataframe
+        column = target_column
+        if summarize_first:
+            # only summarize rows that do not already have a summary
+            done = df[summary_column].notna() if summary_column in df.columns else pd.Series(False, index=df.index)
+            if not done.all():
+                summarized = self._child(df.loc[~done, [target_column]].copy()).summarize(target_column=target_column,
+                                                                                         summary_column=summary_column,
+                                                                                         workers=workers,
+                                                                                         temperature=temperature,
+                                                                                         max_reply_tokens=max_reply_tokens,
+                                                                                         dedup=dedup,
+                                                                                         near_duplicate_threshold=near_duplicate_threshold,
+                                                                                         max_text_tokens=max_text_tokens,
+                                                                                         over_budget=over_budget).dataframe
+                df.loc[~done.to_numpy(), summary_column] = summarized[summary_column].to_numpy()
+            column = summary_column
+
+        options = dict(temperature=temperature,
+                       max_reply_tokens=max_reply_tokens,
+                       dedup=dedup,
+                       near_duplicate_threshold=near_duplicate_threshold,
+                       max_text_tokens=max_text_tokens,
+                       over_budget=over_budget,
+                       embedding_margin=embedding_margin,
+                       constrained=constrained,
+                       cascade_model=cascade_model,
+                       cascade_client=cascade_client)
+
+        # every group at a level draws on one budget of `workers` requests in flight
+        shared_limiter = BoundedLimiter(self.rate_limiter, workers)
+
+        def model_level(frame, topic_name, category, num, topic, level_workers):
+            modeler = self._child(frame)
+            modeler.rate_limiter = shared_limiter
+            condenser = modeler.condense(target_column=column,
+                                         num_topics=num,
+                                         topic=topic,
+                                         max_reply_tokens=max_reply_tokens,
+                                         max_input_tokens=max_input_tokens,
+                                         map_reduce=map_reduce,
+                                         workers=level_workers,
+                                         fan_in=fan_in)
+            return modeler.classify(topics=condenser.common_topics,
+                                    target_column=column,
+                                    topic_name=topic_name,
+                                    category=category,
+                                    workers=level_workers,
+                                    token_counts=condenser.token_counts,
+                                    **options).dataframe
+
+        df = model_level(df, levels[0], 'topic', num_topics, None, workers)
+
+        for level in range(1, depth):
+            parents = levels[:level]
+            # groups are kept as row positions so labels are written back by position, even on a duplicate index
+            groups = [(key if isinstance(key, tuple) else (key,), positions)
+                      for key, positions in df.groupby(parents, sort=False, observed=True).indices.items()]
+            groups = [(key, positions) for key, positions in groups if key[-1] not in ('No Topic', 'No Subtopic')]
+            total = sum(len(positions) for _, positions in groups)
+
+            # groups run side by side with threads split by group size, the shared limiter keeps the total within workers
+            def model_group(group):
+                key, positions = group
+                path = ' > '.join(str(label) for label in key)
+                try:
+                    return model_level(df[[column]].iloc[positions].copy(), levels[level], 'subtopic', num_subtopics, path,
+                                       max(1, round(workers*len(positions)/total)))[levels[level]].to_numpy(dtype=object)
+                except Exception as e:
+                    self.log(f"{datetime.now()}: FAILED modeling {levels[level]} of {path} with exception {e}")
+                    return None
+
+            subtopics = np.full(len(df), None, dtype=object)
+            self.log(f"{datetime.now()}: Modeling {levels[level]} for {len(groups)} groups")
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as executor:
+                for (_, positions), labels in zip(groups, executor.map(model_group, groups)):
+                    if labels is not None:
+                        subtopics[positions] = labels
+            df[levels[level]] = pd.Series(subtopics, index=df.index, dtype='category')
+
+        self.dataframe = df
+
+        return self.dataframe
+
+    def _require_async_client(self):
+        if self.azure_async_client is None:
+            raise ValueError("An AsyncAzureOpenAI client must be provided as azure_async_client to use async methods.")
+
+    async def asummarize(self,
+            target_column: str,
+            summary_column: str = 'summary',
+            workers: int = 100,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate'
+            ):
+        self._require_async_client()
+        summarizer = AsyncSummarizer(dataframe=self.dataframe,
+                        azure_client=self.azure_async_client,
+                        azure_model=self.azure_model,
+                        target_column=target_column,
+                        summary_column=summary_column,
+                        workers=workers,
+                        log_path=self.log_path,
+                        temperature=temperature,
+                        max_reply_tokens=max_reply_tokens,
+                        cache=self.cache,
+                        rate_limiter=self.rate_limiter,
+                        metrics=self.metrics,
+                        dedup=dedup,
+                        near_duplicate_threshold=near_duplicate_threshold,
+                        journal=Checkpoint(checkpoint_path).journal(summary_column) if checkpoint_path else None,
+                        max_text_tokens=max_text_tokens,
+                        over_budget=over_budget,
+                        encoding_name=self.encoding_name
+                        )
+
+        await summarizer.abulk_summarize_transcripts()
+
+        return summarizer
+
+    async def acondense(self,
+            target_column: str = 'summary',
+            num_topics: int = 15,
+            topic: str = None,
+            temperature: float = 0,
+            max_reply_tokens: int = 4000,
+            max_input_tokens: int = 20000,
+            map_reduce: bool = False,
+            workers: int = 1,
+            fan_in: int = 4
+            ):
+        self._require_async_client()
+        condenser = AsyncCondenser(dataframe=self.dataframe,
+            azure_client=self.azure_async_client,
+            azure_model=self.azure_model,
+            target_column=target_column,
+            num_topics=num_topics,
+            topic=topic,
+            log_path=self.log_path,
+            temperature=temperature,
+            max_reply_tokens=max_reply_tokens,
+            max_input_tokens=max_input_tokens,
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+            workers=workers,
+            fan_in=fan_in,
+            encoding_name=self.encoding_name)
+
+        if map_reduce:
+            await condenser.amap_reduce_topics_from_dataframe()
+        else:
+            await condenser.acondense_topics_from_dataframe()
+
+        return condenser
+
+    async def aclassify(self,
+            topics: List[str],
+            target_column: str = 'redacted_transcript',
+            topic_name: str = 'topic',
+            category: str = 'topic',
+            workers: int = 100,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            batch_size: int = 1,
+            batch_token_budget: int = 4000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            token_counts: pd.Series = None,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AsyncAzureOpenAI = None):
+        self._require_async_client()
+        classifier = AsyncClassifier(dataframe=self.dataframe,
+            azure_client=self.azure_async_client,
+            azure_model=self.azure_model,
+            topics=topics,
+            target_column=target_column,
+            topic_name=topic_name,
+            category=category,
+            workers=workers,
+            log_path=self.log_path,
+            temperature=temperature,
+            max_reply_tokens=max_reply_tokens,
+            cache=self.cache,
+            rate_limiter=self.rate_limiter,
+            metrics=self.metrics,
+            batch_size=batch_size,
+            batch_token_budget=batch_token_budget,
+            dedup=dedup,
+            near_duplicate_threshold=near_duplicate_threshold,
+            journal=Checkpoint(checkpoint_path).journal(topic_name) if checkpoint_path else None,
+            max_text_tokens=max_text_tokens,
+            over_budget=over_budget,
+            token_counts=token_counts,
+            embedder=self.embedder,
+            embedding_margin=embedding_margin,
+            constrained=constrained,
+            cascade_model=cascade_model,
+            cascade_client=cascade_client,
+            encoding_name=self.encoding_name)
+
+        await classifier.aclassify_topics()
+
+        return classifier
+
+    async def amodel_column(self,
+            target_column: str,
+            topic_name: str = 'topic',
+            summary_column: str = 'summary',
+            category: str = 'topic',
+            summarize_first: bool = False,
+            workers: int = 100,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            num_topics: int = 15,
+            topic: str = None,
+            max_input_tokens: int = 20000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            checkpoint_path: str = None,
+            max_text_tokens: int = None,
+            over_budget: str = 'truncate',
+            map_reduce: bool = False,
+            fan_in: int = 4,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AsyncAzureOpenAI = None):
+
+        if summarize_first:
+            summarizer = await self.asummarize(target_column=target_column,
+                                               summary_column=summary_column,
+                                               workers=workers,
+                                               temperature=temperature,
+                                               max_reply_tokens=max_reply_tokens,
+                                               dedup=dedup,
+                                               near_duplicate_threshold=near_duplicate_threshold,
+                                               checkpoint_path=checkpoint_path,
+                                               max_text_tokens=max_text_tokens,
+                                               over_budget=over_budget)
+            self.dataframe=summarizer.dataframe
+            target_column=summary_column
+
+        checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+        topics = checkpoint.load_topics(topic_name) if checkpoint else None
+        token_counts = None
+        if topics is None:
+            condenser = await self.acondense(target_column=target_column,
+                                             num_topics=num_topics,
+                                             topic=topic,
+                                             max_reply_tokens=max_reply_tokens,
+                                             max_input_tokens=max_input_tokens,
+                                             map_reduce=map_reduce,
+                                             workers=workers,
+                                             fan_in=fan_in)
+            topics = condenser.common_topics
+            token_counts = condenser.token_counts
+            if checkpoint:
+                checkpoint.save_topics(topic_name, topics)
+
+        classifier = await self.aclassify(topics=topics,
+                                          target_column=target_column,
+                                          topic_name=topic_name,
+                                          category=category,
+                                          workers=workers,
+                                          temperature=temperature,
+                                          max_reply_tokens=max_reply_tokens,
+                                          dedup=dedup,
+                                          near_duplicate_threshold=near_duplicate_threshold,
+                                          checkpoint_path=checkpoint_path,
+                                          max_text_tokens=max_text_tokens,
+                                          over_budget=over_budget,
+                                          token_counts=token_counts,
+                                          embedding_margin=embedding_margin,
+                                          constrained=constrained,
+                                          cascade_model=cascade_model,
+                                          cascade_client=cascade_client)
+
+        self.dataframe=classifier.dataframe
+
         return self.dataframe
\ No newline at end of file
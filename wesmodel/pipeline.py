@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from tqdm import tqdm
+from .summarize import Summarizer
+from .checkpoint import Checkpoint
+from .results import ResultColumn, OK
+from . import tokens
+
+# summarize -> condense -> classify on one worker pool. Condensation starts as
+# soon as the finished summaries fill its token budget, and from then on every
+# summary is classified as it arrives instead of waiting for the slowest row.
+
+class Pipeline:
+    def __init__(self,
+            summarizer: Summarizer,
+            make_condenser,
+            make_classifier,
+            workers: int = 1,
+            condense_tokens: int = 20000,
+            topics=None,
+            checkpoint: Checkpoint = None,
+            topic_name: str = 'topic'
+            ):
+        # make_condenser(dataframe) returns a Condenser that has already run, make_classifier(dataframe, topics) a Classifier
+        self.summarizer = summarizer
+        self.make_condenser = make_condenser
+        self.make_classifier = make_classifier
+        self.workers = workers
+        self.condense_tokens = condense_tokens
+        self.topics = topics
+        self.checkpoint = checkpoint
+        self.topic_name = topic_name
+        self.classifier = None
+        self.condenser = None
+        self.topic_vectors = None
+
+    def log(self, input: str):
+        self.summarizer.log(input)
+
+    def summarize_row(self, position, transcript):
+        try:
+            return position, self.summarizer.summarize_transcript(transcript)
+        except Exception as e:
+            self.log(f"{datetime.now()}: FAILED with exception {e}")
+            return position, None
+
+    def classify_row(self, position, summary, system_prompt):
+        try:
+            return position, self.classifier.classify_transcript(summary, system_prompt)
+        except Exception as e:
+            self.log(f"{datetime.now()}: FAILED with exception {e}")
+            return position, None
+
+    def embed_rows(self, items):
+        # returns the (position, topic) pairs the embedding settled and the rows left for the model
+        try:
+            return self.classifier.match_by_embedding(items, self.topic_vectors)
+        except Exception as e:
+            self.log(f"{datetime.now()}: FAILED embedding {len(items)} summaries with exception {e}")
+            return [], items
+
+    def condense(self, summaries):
+        column = self.summarizer.summary_column
+        self.log(f"{datetime.now()}: Condensing topics from the first {len(summaries)} summaries")
+        self.condenser = self.make_condenser(pd.DataFrame({column: summaries}))
+        return self.condenser
+
+    def start_classifier(self, topics):
+        self.topics = topics
+        if self.checkpoint and topics:
+            self.checkpoint.save_topics(self.topic_name, topics)
+        self.classifier = self.make_classifier(self.summarizer.dataframe, topics)
+        self.classifier.results = ResultColumn(len(self.summarizer.dataframe))
+        if self.classifier.embedder and topics:
+            # summaries are embedded in batches as they arrive, so the topics are embedded once up front
+            self.topic_vectors = self.classifier.embedder.embed(topics)
+        self.system_prompt = self.classifier.build_system_prompt()
+        # topics are journaled against the summary they were classified from
+        summaries = self.summarizer.results.values
+        self.journaled = self.classifier.journal.resume(self.summarizer.dataframe.index, summaries) if self.classifier.journal else {}
+
+    def run(self):
+        summarizer = self.summarizer
+        df = summarizer.dataframe
+        column = summarizer.summary_column
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin pipelined modeling of {len(df)} Transcripts")
+
+        # the Classifier checks that its column exists; the summaries themselves are assigned at the end
+        df[column] = None
+        items = summarizer.pending_items()
+        # rows resumed from the journal already have their summary
+        results = summarizer.results
+        summaries = [(position, results.values[position]) for position in np.flatnonzero(results.status == OK).tolist()]
+        ready = list(summaries)
+        summary_tokens = sum(tokens.count_tokens(summary, summarizer.encoding_name) for _, summary in summaries)
+        if self.topics is not None:
+            self.start_classifier(self.topics)
+
+        # ready summaries are embedded (when there are topic vectors) and the rest asked of the model
+        embedding, asking = [], []
+        remaining = iter(items)
+        exhausted = False
+        futures = {}
+        window = self.workers*2
+        summarizing = 0
+        condensing = False
+        summarized_bar = tqdm(total=len(items), desc="Summarizing")
+        classified_bar = tqdm(total=len(items) + len(ready), desc="Classifying")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                # finished summaries go first so results flow straight through the pipeline
+                summaries_done = exhausted and not summarizing
+                if self.classifier is not None:
+                    while ready:
+                        position, summary = ready.pop()
+                        if position in self.journaled:
+                            self.classifier.record(position, self.journaled[position], summary)
+                            classified_bar.update(1)
+                            continue
+                        (embedding if self.topic_vectors is not None else asking).append((position, summary))
+                    # a full batch at a time, or whatever is left once no more summaries are coming
+                    batch_size = self.classifier.embedder.batch_size if self.topic_vectors is not None else 0
+                    while embedding and (len(embedding) >= batch_size or summaries_done) and len(futures) < window:
+                        futures[executor.submit(self.embed_rows, embedding[:batch_size])] = 'embed'
+                        embedding = embedding[batch_size:]
+                    while asking and len(futures) < window:
+                        futures[executor.submit(self.classify_row, *asking.pop(), self.system_prompt)] = 'classify'
+
+                if self.topics is None and not condensing and summaries and (summary_tokens >= self.condense_tokens or summaries_done):
+                    futures[executor.submit(self.condense, [summary for _, summary in summaries])] = 'condense'
+                    condensing = True
+
+                while not exhausted and len(futures) < window:
+                    item = next(remaining, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    futures[executor.submit(self.summarize_row, *item)] = 'summarize'
+                    summarizing += 1
+
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    kind = futures.pop(future)
+                    if kind == 'summarize':
+                        summarizing -= 1
+                        position, summary = future.result()
+                        summarizer.record(position, summary)
+                        summarized_bar.update(1)
+                        if results.status[position] != OK:
+                            classified_bar.total -= 1
+                            continue
+                        summaries.append((position, summary))
+                        ready.append((position, summary))
+                        summary_tokens += tokens.count_tokens(summary, summarizer.encoding_name)
+                    elif kind == 'condense':
+                        self.start_classifier(future.result().common_topics)
+                    elif kind == 'embed':
+                        matched, fallback = future.result()
+                        for position, topic in matched:
+                            self.classifier.record(position, topic, results.values[position])
+                        self.classifier.embedding_assigned += len(matched)
+                        classified_bar.update(len(matched))
+                        asking.extend(fallback)
+                    else:
+                        position, topic = future.result()
+                        self.classifier.record(position, topic, results.values[position])
+                        classified_bar.update(1)
+
+        summarized_bar.close()
+        classified_bar.close()
+
+        if self.classifier is None:
+            # nothing was summarized, so there is nothing to condense or classify
+            self.start_classifier([])
+        summarizer.finish(start_time)
+        # rows without a usable summary were never classified
+        self.classifier.results.skip(results.status != OK)
+        self.classifier.groups = summarizer.groups
+        if self.topic_vectors is not None:
+            self.log(f"{datetime.now()}: Assigned {self.classifier.embedding_assigned} Transcripts by embedding")
+        self.classifier.finish(start_time)
+
+        return self.classifier
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+import openai
+from .ratelimit import RateLimiter
+
+# Spreads chat completions over several deployments behind the client interface
+# the stages already use. Each endpoint paces itself with its own RateLimiter,
+# requests go to the least loaded endpoint relative to its weight, and an endpoint
+# that keeps throttling or erroring is taken out of rotation by a circuit breaker
+# while its requests fail over to the others.
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+def is_request_error(error):
+    # the request itself was rejected, so every other endpoint would reject it too
+    return isinstance(error, (openai.BadRequestError, openai.UnprocessableEntityError))
+
+class Endpoint:
+    def __init__(self,
+            client,
+            deployment: str,
+            requests_per_minute: int = None,
+            tokens_per_minute: int = None,
+            weight: float = None,
+            name: str = None,
+            encoding_name: str = 'cl100k_base'
+            ):
+        self.client = client
+        self.deployment = deployment
+        self.name = name or deployment
+        self.weight = weight or tokens_per_minute or requests_per_minute or 1
+        if self.weight <= 0:
+            raise ValueError('Endpoint weight must be positive.')
+        self.limiter = RateLimiter(requests_per_minute=requests_per_minute,
+                                   tokens_per_minute=tokens_per_minute,
+                                   encoding_name=encoding_name)
+        self.calls = 0
+        self.errors = 0
+        self.failures = 0
+        self.opened_until = 0
+
+    def state(self, now: float):
+        if self.opened_until > now:
+            return OPEN
+        return HALF_OPEN if self.opened_until else CLOSED
+
+    def load(self):
+        return (self.limiter.in_flight + 1)/self.weight
+
+class PoolCompletions:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def create(self, **kwargs):
+        pool = self.pool
+        tokens = pool.estimate_tokens(kwargs.get('messages'), kwargs.get('max_tokens'))
+        tried, error = set(), None
+        while True:
+            endpoint, wait = pool.select(tokens, tried)
+            if endpoint is None:
+                if wait is None:
+                    raise error
+                time.sleep(wait)
+                continue
+            try:
+                response = endpoint.client.chat.completions.create(**{**kwargs, 'model': endpoint.deployment})
+            except Exception as e:
+                pool.failed(endpoint, tokens[endpoint], e)
+                if is_request_error(e):
+                    raise
+                tried.add(endpoint)
+                error = e
+                continue
+            pool.succeeded(endpoint, tokens[endpoint], response)
+            return response
+
+class AsyncPoolCompletions(PoolCompletions):
+    async def create(self, **kwargs):
+        pool = self.pool
+        tokens = pool.estimate_tokens(kwargs.get('messages'), kwargs.get('max_tokens'))
+        tried, error = set(), None
+        while True:
+            endpoint, wait = pool.select(tokens, tried)
+            if endpoint is None:
+                if wait is None:
+                    raise error
+                await asyncio.sleep(wait)
+                continue
+            try:
+                response = await endpoint.client.chat.completions.create(**{**kwargs, 'model': endpoint.deployment})
+            except Exception as e:
+                pool.failed(endpoint, tokens[endpoint], e)
+                if is_request_error(e):
+                    raise
+                tried.add(endpoint)
+                error = e
+                continue
+            pool.succeeded(endpoint, tokens[endpoint], response)
+            return response
+
+class ClientPool:
+    _completions = PoolCompletions
+
+    def __init__(self,
+            endpoints,
+            failure_threshold: int = 3,
+            cooldown: float = 30
+            ):
+        if not endpoints:
+            raise ValueError('ClientPool needs at least one endpoint.')
+        if failure_threshold < 1:
+            raise ValueError('failure_threshold must be at least 1.')
+        self.endpoints = list(endpoints)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failovers = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=self._completions(self))
+
+    def estimate_tokens(self, messages, max_tokens: int):
+        return {endpoint: endpoint.limiter.estimate_tokens(messages or [], max_tokens) for endpoint in self.endpoints}
+
+    def select(self, tokens, tried):
+        # returns (endpoint, None) once an endpoint has admitted the request, otherwise
+        # (None, seconds to wait), or (None, None) when every endpoint has been tried
+        with self._lock:
+            now = time.monotonic()
+            wait = None
+            candidates = []
+            for endpoint in self.endpoints:
+                if endpoint in tried:
+                    continue
+                state = endpoint.state(now)
+                if state == OPEN:
+                    # only wait out a breaker when nothing has been tried, otherwise give the error back
+                    if not tried:
+                        wait = endpoint.opened_until - now if wait is None else min(wait, endpoint.opened_until - now)
+                    continue
+                # a half-open endpoint gets a single trial request
+                if state == HALF_OPEN and endpoint.limiter.in_flight:
+                    continue
+                candidates.append(endpoint)
+            for endpoint in sorted(candidates, key=Endpoint.load):
+                pause = endpoint.limiter._try_acquire(tokens[endpoint])
+                if not pause:
+                    endpoint.calls += 1
+                    if tried:
+                        self.failovers += 1
+                    return endpoint, None
+                wait = pause if wait is None else min(wait, pause)
+            return None, wait
+
+    def failed(self, endpoint: Endpoint, tokens: int, error):
+        if isinstance(error, openai.RateLimitError):
+            endpoint.limiter.throttle(tokens, error, 0)
+        else:
+            endpoint.limiter.release(tokens)
+        if is_request_error(error):
+            return
+        with self._lock:
+            endpoint.errors += 1
+            endpoint.failures += 1
+            # a failed trial reopens the breaker straight away
+            if endpoint.opened_until or endpoint.failures >= self.failure_threshold:
+                endpoint.opened_until = time.monotonic() + self.cooldown
+
+    def succeeded(self, endpoint: Endpoint, tokens: int, response):
+        endpoint.limiter.release(tokens, response)
+        with self._lock:
+            endpoint.failures = 0
+            endpoint.opened_until = 0
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {'failovers': self.failovers,
+                    'endpoints': {endpoint.name: {'state': endpoint.state(now),
+                                                  'weight': endpoint.weight,
+                                                  'calls': endpoint.calls,
+                                                  'errors': endpoint.errors,
+                                                  **endpoint.limiter.stats()} for endpoint in self.endpoints}}
+
+class AsyncClientPool(ClientPool):
+    _completions = AsyncPoolCompletions
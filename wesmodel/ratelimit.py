@@ -0,0 +1,198 @@
+import asyncio
+import random
+import threading
+import time
+from .tokens import get_encoding
+
+def retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 1000), ('retry-after', 1)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value)/scale
+        except ValueError:
+            continue
+    return None
+
+class RateLimiter:
+    def __init__(self,
+            requests_per_minute: int = None,
+            tokens_per_minute: int = None,
+            max_concurrency: int = None,
+            min_concurrency: int = 1,
+            base_backoff: float = 1,
+            max_backoff: float = 60,
+            encoding_name: str = 'cl100k_base'
+            ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.encoding_name = encoding_name
+
+        # buckets start full and refill continuously at their per-minute rate
+        self.request_allowance = requests_per_minute
+        self.token_allowance = tokens_per_minute
+        self.concurrency = max_concurrency or float('inf')
+        self.in_flight = 0
+        self.paused_until = 0
+        self.throttled = 0
+        self.completed = 0
+        self._successes = 0
+        self._last_decrease = 0
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def estimate_tokens(self, messages, max_tokens: int):
+        if not self.tokens_per_minute:
+            return 0
+        encoding = get_encoding(self.encoding_name)
+        # every message carries a few tokens of chat formatting on top of its content
+        prompt_tokens = sum(len(encoding.encode(message['content'], disallowed_special=())) + 4 for message in messages)
+        return min(prompt_tokens + (max_tokens or 0), self.tokens_per_minute)
+
+    def _refill(self, now):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self.request_allowance = min(self.requests_per_minute, self.request_allowance + elapsed*self.requests_per_minute/60)
+        if self.tokens_per_minute:
+            self.token_allowance = min(self.tokens_per_minute, self.token_allowance + elapsed*self.tokens_per_minute/60)
+
+    def _try_acquire(self, tokens):
+        # returns 0 once a slot has been taken, otherwise how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.in_flight >= self.concurrency:
+                return 0.05
+            wait = 0
+            if self.requests_per_minute and self.request_allowance < 1:
+                wait = max(wait, (1 - self.request_allowance)*60/self.requests_per_minute)
+            if self.tokens_per_minute and self.token_allowance < tokens:
+                wait = max(wait, (tokens - self.token_allowance)*60/self.tokens_per_minute)
+            if wait:
+                return wait
+            if self.requests_per_minute:
+                self.request_allowance -= 1
+            if self.tokens_per_minute:
+                self.token_allowance -= tokens
+            self.in_flight += 1
+            return 0
+
+    def acquire(self, messages, max_tokens: int):
+        tokens = self.estimate_tokens(messages, max_tokens)
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return tokens
+            time.sleep(wait)
+
+    async def aacquire(self, messages, max_tokens: int):
+        tokens = self.estimate_tokens(messages, max_tokens)
+        while True:
+            wait = self._try_acquire(tokens)
+            if not wait:
+                return tokens
+            await asyncio.sleep(wait)
+
+    def release(self, tokens: int, response=None):
+        with self._lock:
+            self.in_flight -= 1
+            used = getattr(getattr(response, 'usage', None), 'total_tokens', None)
+            if self.tokens_per_minute and used is not None:
+                # hand back whatever the estimate over-reserved
+                self.token_allowance = min(self.tokens_per_minute, self.token_allowance + max(0, tokens - used))
+            if response is None:
+                return
+            self.completed += 1
+            self._successes += 1
+            # additive increase: one extra slot per window of clean requests
+            if self._successes >= self.concurrency:
+                self._successes = 0
+                if self.max_concurrency is None or self.concurrency < self.max_concurrency:
+                    self.concurrency += 1
+
+    def throttle(self, tokens: int, error, attempt: int):
+        retry_after = retry_after_seconds(error)
+        with self._lock:
+            self.in_flight -= 1
+            self.throttled += 1
+            self._successes = 0
+            now = time.monotonic()
+            # multiplicative decrease, at most once per second so a burst of 429s only halves once
+            if now - self._last_decrease > 1:
+                self._last_decrease = now
+                self.concurrency = max(self.min_concurrency, min(self.concurrency, self.in_flight + 1)//2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff*2**attempt))
+        return max(delay, retry_after or 0)
+
+    def stats(self):
+        return {'in_flight': self.in_flight,
+                'concurrency': self.concurrency,
+                'completed': self.completed,
+                'throttled': self.throttled}
+
+class BoundedLimiter:
+    # caps the requests in flight across every stage that shares it, on top of another limiter's quotas
+    def __init__(self, limiter: RateLimiter, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be positive.')
+        self.limiter = limiter
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self._free = threading.Condition()
+
+    def _try_take(self):
+        with self._free:
+            if self.in_flight >= self.max_concurrency:
+                return False
+            self.in_flight += 1
+            return True
+
+    def _give_back(self):
+        with self._free:
+            self.in_flight -= 1
+            self._free.notify()
+
+    def estimate_tokens(self, messages, max_tokens: int):
+        return self.limiter.estimate_tokens(messages, max_tokens)
+
+    def acquire(self, messages, max_tokens: int):
+        with self._free:
+            self._free.wait_for(lambda: self.in_flight < self.max_concurrency)
+            self.in_flight += 1
+        try:
+            return self.limiter.acquire(messages, max_tokens)
+        except BaseException:
+            self._give_back()
+            raise
+
+    async def aacquire(self, messages, max_tokens: int):
+        while not self._try_take():
+            await asyncio.sleep(0.05)
+        try:
+            return await self.limiter.aacquire(messages, max_tokens)
+        except BaseException:
+            self._give_back()
+            raise
+
+    def release(self, tokens: int, response=None):
+        self._give_back()
+        self.limiter.release(tokens, response)
+
+    def throttle(self, tokens: int, error, attempt: int):
+        self._give_back()
+        return self.limiter.throttle(tokens, error, attempt)
+
+    def stats(self):
+        return {**self.limiter.stats(), 'shared_in_flight': self.in_flight, 'max_concurrency': self.max_concurrency}
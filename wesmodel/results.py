@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+from .dedup import broadcast_results
+
+# Stage results are collected by row position into preallocated arrays and
+# written to the frame once at the end, with a status column beside them so
+# failures never have to be found by matching strings in the output.
+
+STATUSES = ['ok', 'failed', 'skipped']
+OK, FAILED, SKIPPED = range(len(STATUSES))
+
+class ResultColumn:
+    def __init__(self, length: int):
+        self.values = np.full(length, None, dtype=object)
+        # anything never recorded counts as failed
+        self.status = np.full(length, FAILED, dtype=np.int8)
+
+    def record(self, position: int, value):
+        if value is None:
+            self.status[position] = FAILED
+            return False
+        self.values[position] = value
+        self.status[position] = OK
+        return True
+
+    def skip(self, positions):
+        self.status[positions] = SKIPPED
+
+    def broadcast(self, groups):
+        broadcast_results(self.values, groups)
+        broadcast_results(self.status, groups)
+
+    def count(self, status: int):
+        return int((self.status == status).sum())
+
+    def assign(self, dataframe: pd.DataFrame, column: str, categorical: bool = False):
+        dataframe[column] = pd.Categorical(self.values) if categorical else self.values
+        dataframe[f'{column}_status'] = pd.Categorical.from_codes(self.status, STATUSES)
@@ -0,0 +1,345 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from openai import AzureOpenAI
+from .modeler import NLPTopicModeler
+from .results import STATUSES
+from .logwriter import get_log_writer
+
+# Splits a DataFrame into shards behind a SQLite work queue so a job can be spread
+# over many processes and hosts. Workers lease a shard, run the usual Summarizer
+# or Classifier over it and write the result next to the queue. A lease that is
+# not renewed expires, so the shards of a worker that died are handed out again.
+# Every path is stored relative to the queue directory, which hosts share.
+#
+#   python -m wesmodel.shard work ./queue --model gpt-4o --workers 32 --processes 4
+
+STAGES = ('summarize', 'classify')
+
+class WorkQueue:
+    def __init__(self, path: str):
+        for directory in ('shards', 'results', 'checkpoints'):
+            # several processes may create the same queue directory at once
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # no WAL: it needs shared memory, which does not work across hosts on a network filesystem
+        self._conn = sqlite3.connect(os.path.join(path, 'queue.sqlite'), timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS job (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            stage TEXT NOT NULL,
+            options TEXT NOT NULL,
+            lease_seconds REAL NOT NULL,
+            max_attempts INTEGER NOT NULL,
+            created REAL NOT NULL)""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS shards (
+            id INTEGER PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            result TEXT,
+            error TEXT)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS shards_status ON shards (status)")
+
+    def _transaction(self, statements):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never lease the same shard
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def job(self):
+        with self._lock:
+            row = self._conn.execute("SELECT stage, options, lease_seconds, max_attempts FROM job").fetchone()
+        if row is None:
+            return None
+        return {'stage': row[0], 'options': json.loads(row[1]), 'lease_seconds': row[2], 'max_attempts': row[3]}
+
+    def input_path(self, shard_id: int):
+        return os.path.join(self.path, 'shards', f'{shard_id:06d}.pkl')
+
+    def result_path(self, result: str):
+        return os.path.join(self.path, 'results', result)
+
+    def checkpoint_path(self, shard_id: int):
+        return os.path.join(self.path, 'checkpoints', f'{shard_id:06d}')
+
+    def create(self, dataframe: pd.DataFrame, stage: str, options: dict, shard_size: int, lease_seconds: float, max_attempts: int):
+        if self.job() is not None:
+            raise ValueError(f"{self.path} already holds a job, use a new directory")
+        starts = range(0, len(dataframe), shard_size)
+        # write the shard files first so no worker can lease a shard whose input is missing
+        for shard_id, start in enumerate(starts):
+            dataframe.iloc[start:start + shard_size].to_pickle(self.input_path(shard_id))
+
+        def insert(conn):
+            conn.execute("INSERT INTO job (id, stage, options, lease_seconds, max_attempts, created) VALUES (0, ?, ?, ?, ?, ?)",
+                         (stage, json.dumps(options), lease_seconds, max_attempts, time.time()))
+            conn.executemany("INSERT INTO shards (id, rows, status) VALUES (?, ?, 'pending')",
+                             [(shard_id, min(shard_size, len(dataframe) - start)) for shard_id, start in enumerate(starts)])
+        self._transaction(insert)
+        return len(starts)
+
+    def _expire(self, conn, max_attempts: int):
+        # uses the wall clock, since leases are compared across hosts
+        return conn.execute("""UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                                 worker = NULL, error = 'lease expired'
+                               WHERE status = 'leased' AND lease_expires < ?""", (max_attempts, time.time())).rowcount
+
+    def requeue_expired(self):
+        job = self.job()
+        return self._transaction(lambda conn: self._expire(conn, job['max_attempts']))
+
+    def lease(self, worker: str):
+        job = self.job()
+
+        def take(conn):
+            self._expire(conn, job['max_attempts'])
+            row = conn.execute("SELECT id FROM shards WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE shards SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?",
+                         (worker, time.time() + job['lease_seconds'], row[0]))
+            return row[0]
+        return self._transaction(take)
+
+    def renew(self, shard_id: int, worker: str):
+        job = self.job()
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE shards SET lease_expires = ? WHERE id = ? AND status = 'leased' AND worker = ?",
+            (time.time() + job['lease_seconds'], shard_id, worker)).rowcount == 1)
+
+    def complete(self, shard_id: int, worker: str, result: str):
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE shards SET status = 'done', result = ?, lease_expires = NULL, error = NULL WHERE id = ? AND status = 'leased' AND worker = ?",
+            (result, shard_id, worker)).rowcount == 1)
+
+    def fail(self, shard_id: int, worker: str, error: str):
+        job = self.job()
+        return self._transaction(lambda conn: conn.execute(
+            """UPDATE shards SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                 worker = NULL, lease_expires = NULL, error = ?
+               WHERE id = ? AND status = 'leased' AND worker = ?""",
+            (job['max_attempts'], error, shard_id, worker)).rowcount == 1)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM shards GROUP BY status").fetchall()
+        return {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0, **dict(rows)}
+
+    def shards(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, status, result, error FROM shards ORDER BY id").fetchall()
+        return [{'id': row[0], 'status': row[1], 'result': row[2], 'error': row[3]} for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class ShardWorker:
+    def __init__(self,
+            path: str,
+            azure_client: AzureOpenAI,
+            azure_model: str,
+            log_path: str = f'./logs',
+            workers: int = 1,
+            worker_id: str = None,
+            poll_interval: float = 5,
+            **modeler_options
+            ):
+        # modeler_options (cache, rate_limiter, embedder, metrics, ...) are passed on to NLPTopicModeler
+        self.queue = WorkQueue(path)
+        self.azure_client = azure_client
+        self.azure_model = azure_model
+        self.log_path = log_path
+        self.workers = workers
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.poll_interval = poll_interval
+        self.modeler_options = modeler_options
+        self.processed = 0
+        if not os.path.exists(log_path):
+            os.makedirs(log_path, exist_ok=True)
+        self.logger = get_log_writer(log_path)
+
+    def log(self, input: str):
+        self.logger.log(type(self).__name__, input)
+
+    def keep_leased(self, shard_id: int, done: threading.Event, interval: float):
+        while not done.wait(interval):
+            if not self.queue.renew(shard_id, self.worker_id):
+                self.log(f"{datetime.now()}: Lost the lease on shard {shard_id}")
+                return
+
+    def process(self, shard_id: int, job: dict):
+        dataframe = pd.read_pickle(self.queue.input_path(shard_id))
+        modeler = NLPTopicModeler(dataframe=dataframe,
+                                  azure_client=self.azure_client,
+                                  azure_model=self.azure_model,
+                                  log_path=self.log_path,
+                                  **self.modeler_options)
+        # a per-shard journal lets whoever leases the shard next skip the rows already answered
+        stage = getattr(modeler, job['stage'])(**job['options'],
+                                               workers=self.workers,
+                                               checkpoint_path=self.queue.checkpoint_path(shard_id))
+        result = f"{shard_id:06d}.{self.worker_id.replace(os.sep, '_').replace(':', '_')}.pkl"
+        path = self.queue.result_path(result)
+        stage.dataframe.to_pickle(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        return result
+
+    def run(self, wait: bool = True):
+        job = self.queue.job()
+        if job is None:
+            raise ValueError(f"{self.queue.path} holds no job")
+        self.log(f"{datetime.now()}: Worker {self.worker_id} started on {self.queue.path}")
+        while True:
+            shard_id = self.queue.lease(self.worker_id)
+            if shard_id is None:
+                # shards leased by others come back if their worker dies, so wait for them to settle
+                if wait and self.queue.counts()['leased']:
+                    time.sleep(self.poll_interval)
+                    continue
+                break
+            self.log(f"{datetime.now()}: Leased shard {shard_id}")
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self.keep_leased, args=(shard_id, done, job['lease_seconds']/3), daemon=True)
+            heartbeat.start()
+            try:
+                result = self.process(shard_id, job)
+            except Exception as e:
+                self.log(f"{datetime.now()}: FAILED shard {shard_id} with exception {e}")
+                self.queue.fail(shard_id, self.worker_id, str(e))
+                continue
+            finally:
+                done.set()
+                heartbeat.join()
+            if self.queue.complete(shard_id, self.worker_id, result):
+                self.processed += 1
+                self.log(f"{datetime.now()}: Finished shard {shard_id}")
+            else:
+                self.log(f"{datetime.now()}: Discarded shard {shard_id}, its lease had passed to another worker")
+        self.log(f"{datetime.now()}: Worker {self.worker_id} finished {self.processed} shards")
+        self.queue.close()
+        return self.processed
+
+class ShardCoordinator:
+    def __init__(self,
+            path: str,
+            log_path: str = f'./logs'
+            ):
+        self.queue = WorkQueue(path)
+        self.log_path = log_path
+        if not os.path.exists(log_path):
+            os.makedirs(log_path, exist_ok=True)
+        self.logger = get_log_writer(log_path)
+
+    def log(self, input: str):
+        self.logger.log(type(self).__name__, input)
+
+    def submit(self,
+            dataframe: pd.DataFrame,
+            stage: str = 'classify',
+            shard_size: int = 10000,
+            lease_seconds: float = 600,
+            max_attempts: int = 3,
+            **options):
+        # options are the keyword arguments of NLPTopicModeler.summarize or .classify
+        if stage not in STAGES:
+            raise ValueError(f"stage must be one of {', '.join(STAGES)}")
+        if shard_size < 1:
+            raise ValueError('shard_size must be at least 1.')
+        if 'workers' in options or 'checkpoint_path' in options:
+            raise ValueError('workers and checkpoint_path are set by each ShardWorker.')
+        shards = self.queue.create(dataframe, stage, options, shard_size, lease_seconds, max_attempts)
+        self.log(f"{datetime.now()}: Queued {len(dataframe)} rows in {shards} shards for {stage}")
+        return shards
+
+    def progress(self):
+        return self.queue.counts()
+
+    def wait(self, poll_interval: float = 10, timeout: float = None):
+        start = time.monotonic()
+        last = None
+        while True:
+            expired = self.queue.requeue_expired()
+            if expired:
+                self.log(f"{datetime.now()}: Re-queued {expired} shards whose lease expired")
+            counts = self.queue.counts()
+            if counts != last:
+                self.log(f"{datetime.now()}: Shards {counts}")
+                last = counts
+            if not counts['pending'] and not counts['leased']:
+                return self.merge()
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"{counts['pending'] + counts['leased']} shards still unfinished after {timeout} seconds")
+            time.sleep(poll_interval)
+
+    def output_column(self, job: dict):
+        if job['stage'] == 'summarize':
+            return job['options'].get('summary_column', 'summary')
+        return job['options'].get('topic_name', 'topic')
+
+    def merge(self):
+        job = self.queue.job()
+        column = self.output_column(job)
+        frames = []
+        for shard in self.queue.shards():
+            if shard['status'] == 'done':
+                frames.append(pd.read_pickle(self.queue.result_path(shard['result'])))
+                continue
+            # keep the rows of shards that never finished, flagged like rows that failed within a stage
+            frame = pd.read_pickle(self.queue.input_path(shard['id']))
+            frame[column] = None
+            frame[f'{column}_status'] = 'failed' if shard['status'] == 'failed' else 'skipped'
+            frames.append(frame)
+            if shard['status'] == 'failed':
+                self.log(f"{datetime.now()}: Shard {shard['id']} failed: {shard['error']}")
+        dataframe = pd.concat(frames)
+        if job['stage'] == 'classify':
+            dataframe[column] = dataframe[column].astype(object).astype('category')
+        dataframe[f'{column}_status'] = pd.Categorical(dataframe[f'{column}_status'].astype(object), categories=STATUSES)
+        return dataframe
+
+def work_from_environment(path: str, azure_model: str, workers: int, log_path: str):
+    # AzureOpenAI reads AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_KEY and OPENAI_API_VERSION
+    return ShardWorker(path, azure_client=AzureOpenAI(), azure_model=azure_model, workers=workers, log_path=log_path).run()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m wesmodel.shard',
+                                     description='Work through or inspect a sharded wesmodel job.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    work = commands.add_parser('work', help='lease and process shards until none are left')
+    work.add_argument('path', help='queue directory shared by the coordinator and the workers')
+    work.add_argument('--model', required=True, help='Azure OpenAI deployment name')
+    work.add_argument('--workers', type=int, default=16, help='threads per process')
+    work.add_argument('--processes', type=int, default=1)
+    work.add_argument('--log-path', default='./logs')
+    status = commands.add_parser('status', help='print the number of shards in each state')
+    status.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'status':
+        print(json.dumps(WorkQueue(args.path).counts()))
+        return
+    if args.processes == 1:
+        work_from_environment(args.path, args.model, args.workers, args.log_path)
+        return
+    with multiprocessing.get_context('spawn').Pool(args.processes) as pool:
+        pool.starmap(work_from_environment, [(args.path, args.model, args.workers, args.log_path)]*args.processes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import asyncio
+import time
+import numpy as np
+import openai
+from datetime import datetime
+from .dedup import group_duplicates
+from .results import ResultColumn
+from . import tokens
+
+# Shared plumbing for the stages. ChatStage is the cached, rate limited chat
+# call with its retry loop, and RowStage adds the per-row bookkeeping
+# (deduplication, journal resume, token budget, result recording) used by the
+# Summarizer and Classifier.
+
+class ChatStage:
+    def cache_key(self, model, message_pkg, max_tokens):
+        return self.cache.make_key(model, message_pkg[0]['content'], message_pkg[1]['content'], self.temperature, max_tokens)
+
+    def chat_cached(self, stage, key):
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.metrics.cache_hit(stage)
+        return cached
+
+    def chat_content(self, key, response):
+        if response is None:
+            self.log(f"{datetime.now()}: Failed no response")
+            return None
+        content = response.choices[0].message.content
+        if key is not None:
+            self.cache.set(key, content)
+        return content
+
+    def chat(self, message_pkg, stage: str, max_tokens: int = None, model: str = None, client=None, options: dict = None):
+        max_tokens = max_tokens or self.max_reply_tokens
+        model, client = model or self.azure_model, client or self.azure_client
+        key = self.cache_key(model, message_pkg, max_tokens) if self.cache else None
+        cached = self.chat_cached(stage, key)
+        if cached is not None:
+            return cached
+
+        timer = self.metrics.start(stage)
+        attempt = 0
+        while True:
+            reserved = self.rate_limiter.acquire(message_pkg, max_tokens)
+            timer.sent()
+            try:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=message_pkg,
+                    temperature=self.temperature,
+                    max_tokens=max_tokens,
+                    **(options or {})
+                )
+            except openai.RateLimitError as e:
+                timer.throttled()
+                time.sleep(self.rate_limiter.throttle(reserved, e, attempt))
+                attempt += 1
+                continue
+            except Exception:
+                timer.failed()
+                self.rate_limiter.release(reserved)
+                raise
+            self.rate_limiter.release(reserved, response)
+            timer.succeeded(response)
+            return self.chat_content(key, response)
+
+    async def achat(self, message_pkg, stage: str, max_tokens: int = None, model: str = None, client=None, options: dict = None):
+        max_tokens = max_tokens or self.max_reply_tokens
+        model, client = model or self.azure_model, client or self.azure_client
+        key = self.cache_key(model, message_pkg, max_tokens) if self.cache else None
+        cached = self.chat_cached(stage, key)
+        if cached is not None:
+            return cached
+
+        timer = self.metrics.start(stage)
+        attempt = 0
+        while True:
+            reserved = await self.rate_limiter.aacquire(message_pkg, max_tokens)
+            timer.sent()
+            try:
+                response = await client.chat.completions.create(
+                    model=model,
+                    messages=message_pkg,
+                    temperature=self.temperature,
+                    max_tokens=max_tokens,
+                    **(options or {})
+                )
+            except openai.RateLimitError as e:
+                timer.throttled()
+                await asyncio.sleep(self.rate_limiter.throttle(reserved, e, attempt))
+                attempt += 1
+                continue
+            except Exception:
+                timer.failed()
+                self.rate_limiter.release(reserved)
+                raise
+            self.rate_limiter.release(reserved, response)
+            timer.succeeded(response)
+            return self.chat_content(key, response)
+
+
+class RowStage(ChatStage):
+    def unique_items(self):
+        texts = self.dataframe[self.target_column]
+        values = texts.to_numpy(dtype=object)
+        present = texts.notna().to_numpy()
+        self.texts = values
+        self.results = ResultColumn(len(values))
+        self.results.skip(~present)
+        valid = np.flatnonzero(present).tolist()
+        if not self.dedup:
+            self.groups = None
+            return [(position, values[position]) for position in valid]
+        groups = group_duplicates(texts.iloc[valid], self.near_duplicate_threshold)
+        self.groups = {valid[representative]: [valid[member] for member in members] for representative, members in groups.items()}
+        self.calls_saved = len(valid) - len(self.groups)
+        self.log(f"{datetime.now()}: Deduplicated {len(valid)} Transcripts into {len(self.groups)} unique texts, saving {self.calls_saved} calls")
+        return [(position, values[position]) for position in self.groups]
+
+    def item_token_counts(self, items):
+        # reuse counts computed upstream (e.g. by the Condenser) when they cover every item
+        if self.token_counts is not None and self.token_counts.index.is_unique and self.dataframe.index.is_unique:
+            counts = self.token_counts.reindex(self.dataframe.index[[position for position, _ in items]])
+            if not counts.isna().any():
+                return counts.to_numpy(dtype='int64')
+        return tokens.count_tokens_batch([transcript for _, transcript in items], self.encoding_name)
+
+    def fit_to_budget(self, items):
+        if not self.max_text_tokens or not items:
+            return items
+        fitted, over = [], []
+        for (position, transcript), count in zip(items, self.item_token_counts(items)):
+            if count <= self.max_text_tokens:
+                fitted.append((position, transcript))
+                continue
+            over.append(position)
+            if self.over_budget != 'skip':
+                fitted.append((position, tokens.truncate_tokens(transcript, self.max_text_tokens, self.encoding_name)))
+        if over:
+            if self.over_budget == 'skip':
+                self.results.skip(over)
+            action = 'Skipped' if self.over_budget == 'skip' else 'Truncated'
+            self.log(f"{datetime.now()}: {action} {len(over)} Transcripts over {self.max_text_tokens} tokens")
+        return fitted
+
+    def pending_items(self):
+        items = self.unique_items()
+        if not self.journal:
+            return self.fit_to_budget(items)
+        done = self.journal.resume(self.dataframe.index, self.texts)
+        pending = []
+        for position, transcript in items:
+            if position in done:
+                self.results.record(position, done[position])
+            else:
+                pending.append((position, transcript))
+        self.log(f"{datetime.now()}: Resuming with {len(items)-len(pending)} Transcripts already journaled")
+        return self.fit_to_budget(pending)
+
+    def record(self, position, value, text=None):
+        # text is the stage's input for the row, the target column's value unless the caller passes it
+        if self.results.record(position, value) and self.journal:
+            self.journal.append(self.dataframe.index[position], value, self.texts[position] if text is None else text)
@@ -0,0 +1,206 @@
+import os
+import pandas as pd
+from datetime import datetime
+from typing import List
+from openai import AzureOpenAI
+from .modeler import NLPTopicModeler
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .metrics import Metrics
+from .embed import Embedder
+from .logwriter import get_log_writer
+
+def file_format(path: str):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    raise ValueError(f"Unsupported file type {extension}, expected .csv, .jsonl or .parquet")
+
+def read_chunks(path: str, chunksize: int = 10000):
+    kind = file_format(path)
+    if kind == 'csv':
+        reader = pd.read_csv(path, chunksize=chunksize)
+    elif kind == 'jsonl':
+        reader = pd.read_json(path, lines=True, chunksize=chunksize)
+    else:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading parquet files requires pyarrow, install it with `pip install pyarrow`")
+        reader = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize))
+
+    # give every row a position in the whole file so labels stay unique across chunks
+    offset = 0
+    for chunk in reader:
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk
+
+class ChunkWriter:
+    def __init__(self, path: str):
+        self.kind = file_format(path)
+        self.path = path
+        self.rows = 0
+        self._writer = None
+        if self.kind == 'parquet':
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError("Writing parquet files requires pyarrow, install it with `pip install pyarrow`")
+            self._pyarrow = pyarrow
+
+    def write(self, chunk: pd.DataFrame):
+        mode = 'a' if self.rows else 'w'
+        if self.kind == 'csv':
+            chunk.to_csv(self.path, mode=mode, header=not self.rows, index=False)
+        elif self.kind == 'jsonl':
+            with open(self.path, mode, encoding='utf-8') as file:
+                if len(chunk):
+                    file.write(chunk.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+        else:
+            # labels are written as plain strings, since each chunk's categories differ
+            chunk = chunk.astype({column: object for column in chunk.columns if isinstance(chunk[column].dtype, pd.CategoricalDtype)})
+            if self._writer is None:
+                table = self._pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                # a column with no values in the first chunk (every summary failed, or the chunk was skipped)
+                # is inferred as null, which no later chunk could be written to, so it becomes a string column
+                schema = self._pyarrow.schema([field.with_type(self._pyarrow.string()) if self._pyarrow.types.is_null(field.type) else field
+                                               for field in table.schema]).with_metadata(table.schema.metadata)
+                table = table.cast(schema)
+                self._writer = self._pyarrow.parquet.ParquetWriter(self.path, schema)
+            else:
+                table = self._pyarrow.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class StreamingModeler:
+    def __init__(self,
+            azure_client: AzureOpenAI,
+            azure_model: str,
+            log_path: str = f'./logs',
+            cache: ResponseCache = None,
+            rate_limiter: RateLimiter = None,
+            embedder: Embedder = None,
+            metrics: Metrics = None,
+            encoding_name: str = 'cl100k_base'
+            ):
+        self.azure_client = azure_client
+        self.azure_model = azure_model
+        self.log_path = log_path
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.embedder = embedder
+        self.metrics = metrics or Metrics()
+        self.encoding_name = encoding_name
+        self.topics = None
+        if not os.path.exists(log_path):
+            os.mkdir(log_path)
+        self.logger = get_log_writer(log_path)
+
+    def log(self, input: str):
+        self.logger.log(type(self).__name__, input)
+
+    def model_file(self,
+            input_path: str,
+            output_path: str,
+            target_column: str,
+            topics: List[str] = None,
+            topic_name: str = 'topic',
+            summary_column: str = 'summary',
+            category: str = 'topic',
+            summarize_first: bool = False,
+            workers: int = 1,
+            temperature: float = 0,
+            max_reply_tokens: int = 1000,
+            num_topics: int = 15,
+            topic: str = None,
+            max_input_tokens: int = 20000,
+            chunksize: int = 10000,
+            batch_size: int = 1,
+            batch_token_budget: int = 4000,
+            dedup: bool = False,
+            near_duplicate_threshold: float = None,
+            map_reduce: bool = False,
+            fan_in: int = 4,
+            embedding_margin: float = 0.05,
+            constrained: bool = False,
+            cascade_model: str = None,
+            cascade_client: AzureOpenAI = None):
+
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin streaming {input_path} to {output_path}")
+
+        with ChunkWriter(output_path) as writer:
+            for chunk in read_chunks(input_path, chunksize):
+                modeler = NLPTopicModeler(dataframe=chunk,
+                                          azure_client=self.azure_client,
+                                          azure_model=self.azure_model,
+                                          log_path=self.log_path,
+                                          cache=self.cache,
+                                          rate_limiter=self.rate_limiter,
+                                          embedder=self.embedder,
+                                          metrics=self.metrics,
+                                          encoding_name=self.encoding_name)
+                column = target_column
+                if summarize_first:
+                    summarizer = modeler.summarize(target_column=target_column,
+                                                   summary_column=summary_column,
+                                                   workers=workers,
+                                                   temperature=temperature,
+                                                   max_reply_tokens=max_reply_tokens,
+                                                   dedup=dedup,
+                                                   near_duplicate_threshold=near_duplicate_threshold)
+                    modeler.dataframe = summarizer.dataframe
+                    column = summary_column
+
+                # without a topic list, condense one from the first chunk and keep it for the rest of the file
+                if topics is None:
+                    topics = modeler.condense(target_column=column,
+                                              num_topics=num_topics,
+                                              topic=topic,
+                                              max_reply_tokens=max_reply_tokens,
+                                              max_input_tokens=max_input_tokens,
+                                              map_reduce=map_reduce,
+                                              workers=workers,
+                                              fan_in=fan_in).common_topics
+
+                classifier = modeler.classify(topics=topics,
+                                              target_column=column,
+                                              topic_name=topic_name,
+                                              category=category,
+                                              workers=workers,
+                                              temperature=temperature,
+                                              max_reply_tokens=max_reply_tokens,
+                                              batch_size=batch_size,
+                                              batch_token_budget=batch_token_budget,
+                                              dedup=dedup,
+                                              near_duplicate_threshold=near_duplicate_threshold,
+                                              embedding_margin=embedding_margin,
+                                              constrained=constrained,
+                                              cascade_model=cascade_model,
+                                              cascade_client=cascade_client)
+                writer.write(classifier.dataframe)
+                self.log(f"{datetime.now()}: Wrote {writer.rows} rows to {output_path}")
+
+        self.topics = topics
+        end_time = datetime.now()
+        self.log(f"{end_time}: Finish streaming {writer.rows} rows")
+        self.log(f"Total Streaming Time: {end_time-start_time}")
+
+        return topics
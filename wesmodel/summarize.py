@@ -3,10 +3,19 @@ import openai
 from openai import AzureOpenAI
 from datetime import datetime
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
+from .cache import ResponseCache
+from .ratelimit import RateLimiter
+from .metrics import Metrics
+from .results import OK, FAILED, SKIPPED
+from .checkpoint import Journal
+from .dispatch import bounded_map
+from .stage import RowStage
+from .batch import BatchRunner
+from .logwriter import get_log_writer
 
-class Summarizer:
+class Summarizer(RowStage):
     def __init__(self,
         dataframe: pd.DataFrame,
         azure_client: AzureOpenAI,
@@ -16,10 +25,22 @@ class Summarizer:
         workers: int = 5,
         log_path: str = f'./logs',
         temperature: float = 0,
-        max_reply_tokens: int = 1000
+        max_reply_tokens: int = 1000,
+        cache: ResponseCache = None,
+        rate_limiter: RateLimiter = None,
+        dedup: bool = False,
+        near_duplicate_threshold: float = None,
+        journal: Journal = None,
+        max_text_tokens: int = None,
+        over_budget: str = 'truncate',
+        token_counts: pd.Series = None,
+        metrics: Metrics = None,
+        encoding_name: str = 'cl100k_base'
         ):
         if target_column not in dataframe.columns:
             raise ValueError(f"Dataframe does not contain column {target_column}")
+        if over_budget not in ['truncate', 'skip']:
+            raise ValueError('over_budget must be "truncate" or "skip".')
         self.dataframe = dataframe
         self.azure_client = azure_client
         self.azure_model = azure_model
@@ -27,13 +48,28 @@ class Summarizer:
         self.summary_column = summary_column
         self.workers = workers
         self.log_path = log_path
+        self.logger = get_log_writer(log_path)
         self.temperature = temperature
         self.max_reply_tokens = max_reply_tokens
+        self.cache = cache
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+        self.dedup = dedup
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.groups = None
+        self.calls_saved = 0
+        self.results = None
+        self.texts = None
+        self.journal = journal
+        self.max_text_tokens = max_text_tokens
+        self.over_budget = over_budget
+        self.token_counts = token_counts
+        self.encoding_name = encoding_name
     
     def log(self, input: str):
-        print(input, file=open(f'{self.log_path}/{datetime.now().date()}.txt', 'a'))
+        self.logger.log(type(self).__name__, input)
 
-    def summarize_transcript(self, transcript: str):
+    def build_messages(self, transcript: str):
 
         system_prompt = """INSTRUCTIONS: 
         You are a helpful bot. You will receive the piece of text.  
@@ -43,61 +79,65 @@ class Summarizer:
         Return a string containing the primary topic of the text. Each topic MUST BE five words or fewer. 
         Your response can contain only one reason."""
 
-        message_pkg = [{"role":"system","content":system_prompt},
-                    {"role":"user","content":transcript}]
-        
-        attempt = 0
-        while True:
+        return [{"role":"system","content":system_prompt},
+                {"role":"user","content":transcript}]
+
+    def request_body(self, message_pkg):
+        return {'model': self.azure_model,
+                'messages': message_pkg,
+                'temperature': self.temperature,
+                'max_tokens': self.max_reply_tokens}
+
+    def summarize_transcript(self, transcript: str):
+        return self.chat(self.build_messages(transcript), 'summarize')
+
+    def finish(self, start_time: datetime):
+        if self.journal:
+            self.journal.close()
+        if self.groups:
+            self.results.broadcast(self.groups)
+        self.results.assign(self.dataframe, self.summary_column)
+        end_time = datetime.now()
+        self.log(f"{end_time}: Finish Summarizing {self.results.count(OK)} Transcripts")
+        self.log(f"Failed {self.results.count(FAILED)} Transcripts, skipped {self.results.count(SKIPPED)}")
+        self.log(f"Total Summarization Time: {end_time-start_time}")
+
+    def summarize_items(self, items):
+
+        def process_row(position, transcript):
             try:
-                response = self.azure_client.chat.completions.create(
-                    model=self.azure_model,
-                    messages=message_pkg,
-                    temperature=self.temperature,
-                    max_tokens=self.max_reply_tokens,
-                )
-
-                if response is None:
-                    self.log("FAILED: No response")
-                    return None
-                return response.choices[0].message.content
-            except openai.RateLimitError as e:
-                attempt += 1
-                time.sleep(2 ** attempt)
+                result = self.summarize_transcript(transcript)
+                return position, result
             except Exception as e:
                 self.log(f"{datetime.now()}: FAILED with exception {e}")
-                return f"FAILED: {e}"
-    
+                return position, None
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for result in tqdm(bounded_map(executor, process_row, items, self.workers*2), total=len(items), desc="Summarizing"):
+                self.record(*result)
+
     def bulk_summarize_transcripts(self):
         start_time = datetime.now()
         self.log(f"{start_time}: Begin Summarizing {len(self.dataframe)} Transcripts")
-        
-        self.dataframe[self.summary_column] = None
+        self.summarize_items(self.pending_items())
+        self.finish(start_time)
 
-        def process_row(index, row):
-            try:
-                result = self.summarize_transcript(row[self.target_column])
-                return index, result
-            except Exception as e:
-                print(f"{datetime.now()}: FAILED with exception {e}", file=open(self.log_path, 'a'))
-                return index, None
+    def batch_summarize_transcripts(self, runner: BatchRunner):
+        start_time = datetime.now()
+        self.log(f"{start_time}: Begin batch Summarizing {len(self.dataframe)} Transcripts")
 
-        def update_df(result):
-            index, summary = result
-            if summary is None:
-                self.dataframe.at[index, self.summary_column] = 'FAILED: Uncaught Exception'
-            else:
-                self.dataframe.at[index, self.summary_column] = summary
+        items = self.pending_items()
+        answered = set()
+        requests = ((position, self.request_body(self.build_messages(transcript))) for position, transcript in items)
+        for custom_id, content in runner.run('summarize', requests, self.cache):
+            if content is not None:
+                self.record(int(custom_id), content)
+                answered.add(int(custom_id))
 
-        with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = [executor.submit(process_row, index, row) for index, row in self.dataframe.iterrows()]
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Summarizing"):
-                update_df(future.result())
+        # whatever the batch failed or lost goes through the interactive path
+        retry = [(position, transcript) for position, transcript in items if position not in answered]
+        if retry:
+            self.log(f"{datetime.now()}: Retrying {len(retry)} Transcripts the batch did not answer")
+            self.summarize_items(retry)
 
-        initial = len(self.dataframe)
-        self.dataframe = self.dataframe[~(self.dataframe[self.summary_column].str.contains('FAILED'))]
-        final = len(self.dataframe)
-        end_time = datetime.now()
-        self.log(f"{end_time}: Finish Summarizing {len(self.dataframe)} Transcripts")
-        self.log(f"Dropped {initial-final} Transcripts for Error")
-        self.log(f"Total Summarization Time: {end_time-start_time}")
-        
\ No newline at end of file
+        self.finish(start_time)
@@ -0,0 +1,35 @@
+from functools import lru_cache
+import numpy as np
+import tiktoken
+
+# Loading an encoding parses its whole BPE table, so every caller shares one
+# instance per encoding name instead of calling tiktoken.get_encoding per text.
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = 'cl100k_base'):
+    return tiktoken.get_encoding(encoding_name)
+
+def count_tokens(text, encoding_name: str = 'cl100k_base'):
+    return len(get_encoding(encoding_name).encode(str(text), disallowed_special=()))
+
+def count_tokens_batch(texts, encoding_name: str = 'cl100k_base', num_threads: int = 8):
+    texts = [str(text) for text in texts]
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    encoded = get_encoding(encoding_name).encode_batch(texts, num_threads=num_threads, disallowed_special=())
+    return np.fromiter((len(tokens) for tokens in encoded), dtype=np.int64, count=len(texts))
+
+def truncate_tokens(text, max_tokens: int, encoding_name: str = 'cl100k_base'):
+    encoding = get_encoding(encoding_name)
+    return encoding.decode(encoding.encode(str(text), disallowed_special=())[:max_tokens])
+
+def single_token_ids(texts, encoding_name: str = 'cl100k_base'):
+    # logit_bias works on token ids, so every label it allows must encode to exactly one token
+    encoding = get_encoding(encoding_name)
+    ids = []
+    for text in texts:
+        encoded = encoding.encode(str(text), disallowed_special=())
+        if len(encoded) != 1:
+            raise ValueError(f"{text!r} is {len(encoded)} tokens in {encoding_name}, expected exactly one")
+        ids.append(encoded[0])
+    return ids